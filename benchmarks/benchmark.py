@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import platform
+import warnings
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pandas as pd
+import geopandas as gpd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+DATA = os.path.join(ROOT, 'data')
+sys.path.insert(0, os.path.join(ROOT, 'general-colocation'))                   #benchmark the working tree, not an installed copy
+
+MINNEAPOLIS = {'m100':'Minneapolis_100_Input.csv', 'm1k':'Minneapolis_1k_Input.csv', 'full':'Minneapolis_Input.csv'}
+GRID = {'k':[3,4], 'theta':[0.3,0.5], 'threshold':[100,200]}
+SCALES = [4, 16]                                                                #copies of the full dataset side by side
+SCALE_GRID = {'k':[3], 'theta':[0.3], 'threshold':[100,200]}
+EMERGENT_GRID = {'theta':[0.3,0.6], 'threshold':[100,200,500]}
+SYNTHETIC = {'syn150k':dict(classes=40, patterns=20, k=4, instances=1000, participation=0.3, background=500),
+             'syn1m':dict(classes=100, patterns=50, k=4, instances=4000, participation=0.3, background=2000)}
+SYNTHETIC_GRID = {'k':[4], 'theta':[0.25], 'threshold':[100]}
+QUICK_GRID = {'k':[3], 'theta':[0.3], 'threshold':[200]}
+STARTUP = {'general':('general-colocation', 'general_colocation.general, general_colocation.colocation'),
+           'emergent':('emergent-colocation', 'emergent, colocation')}
+HEAVY_MODULES = ['matplotlib', 'imageio', 'geopandas', 'shapely']              #must not be loaded just to mine
+STARTUP_BUDGET = 1.0
+
+def grid(params):
+    """
+    Every combination of the values in a dictionary of lists.
+    """
+    out = [{}]
+    for key, values in params.items():
+        out = [dict(p, **{key:v}) for p in out for v in values]
+    return out
+
+def get_cases(quick=False):
+    """
+    The benchmark cases as a dictionary of (kind, dataset, parameters) by name.
+    """
+    cases = {'startup/'+name:('startup', name, {}) for name in STARTUP}
+    for name in (['m100','m1k'] if quick else MINNEAPOLIS):
+        for p in grid(QUICK_GRID if quick else GRID):
+            cases['general/'+name+'/k'+str(p['k'])+'_theta'+str(p['theta'])+'_t'+str(p['threshold'])] = ('general', name, p)
+    for copies in ([4] if quick else SCALES):
+        for p in grid(QUICK_GRID if quick else SCALE_GRID):
+            cases['general/full_x'+str(copies)+'/k'+str(p['k'])+'_theta'+str(p['theta'])+'_t'+str(p['threshold'])] = ('general', 'full_x'+str(copies), p)
+    for name in (['syn150k'] if quick else SYNTHETIC):
+        for p in grid(SYNTHETIC_GRID):
+            cases['general/'+name+'/k'+str(p['k'])+'_theta'+str(p['theta'])+'_t'+str(p['threshold'])] = ('general', name, p)
+    for p in grid({'theta':[0.6], 'threshold':[100]} if quick else EMERGENT_GRID):
+        cases['emergent/restaurants/theta'+str(p['theta'])+'_t'+str(p['threshold'])] = ('emergent', 'restaurants', p)
+    return cases
+
+def load_minneapolis(fname):
+    data = pd.read_csv(os.path.join(DATA, fname))
+    data['pos'] = gpd.points_from_xy(data.longitude, data.latitude)
+    return data
+
+def scale_up(data, copies):
+    """
+    Place copies of data side by side from west to east with ids made unique, so the density
+    and patterns of each copy match the original and no copy is near another.
+    """
+    width = (data.longitude.max() - data.longitude.min()) * 1.1
+    parts = []
+    for i in range(copies):
+        part = data.copy()
+        part['longitude'] = part['longitude'] + i * width
+        part['safegraph_place_id'] = part['safegraph_place_id'] + '_' + str(i)
+        parts.append(part)
+    data = pd.concat(parts, ignore_index=True)
+    data['pos'] = gpd.points_from_xy(data.longitude, data.latitude)
+    return data
+
+def get_synthetic(name, threshold):
+    from general_colocation.synthetic import SyntheticData
+    return SyntheticData(threshold=threshold, origin=(-93.27, 44.98), **SYNTHETIC[name])
+
+def load_dataset(name, threshold=None):
+    if name in SYNTHETIC:
+        return get_synthetic(name, threshold).frame().rename(columns={'class':'top_category', 'id':'safegraph_place_id'})
+    if name in MINNEAPOLIS:
+        return load_minneapolis(MINNEAPOLIS[name])
+    if name.startswith('full_x'):
+        return scale_up(load_minneapolis(MINNEAPOLIS['full']), int(name[len('full_x'):]))
+    if name == 'restaurants':                                                   #the workload of notebook_examples/emerging_colocation
+        data = load_minneapolis('Minneapolis_emergent.csv')
+        data = data[(data['brands'] != '') & (data['top_category'] == 'Restaurants and Other Eating Places')]
+        return data.sort_values(by='opened_on')
+    raise ValueError('Unknown dataset '+name)
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:                                                         #not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10           #bytes on macOS, KiB elsewhere
+
+def run_startup(package, repeat):
+    """
+    Time importing the mining modules of a package in a fresh interpreter, keeping the fastest of
+    repeat runs, and list the heavy modules the import loaded.
+    """
+    path, modules = STARTUP[package]
+    code = '\n'.join(['import sys, time, json',
+                      'sys.path.insert(0, '+repr(os.path.join(ROOT, path))+')',
+                      'start = time.perf_counter()',
+                      'import '+modules,
+                      'wall = time.perf_counter() - start',
+                      'print(json.dumps([wall, [m for m in '+repr(HEAVY_MODULES)+' if m in sys.modules]]))'])
+    best = None
+    for _ in range(repeat):
+        wall, loaded = json.loads(subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout)
+        if best is None or wall < best['wall']:
+            best = {'wall':wall, 'phases':{}, 'rows':[], 'rules':0, 'loaded':loaded, 'peak_memory_mb':None}
+    return best
+
+def run_case(case, repeat):
+    """
+    Run one case repeat times in this process and return the fastest run with its per-phase
+    wall times, the size of its result and the peak memory of the process.
+    """
+    warnings.filterwarnings('ignore')
+    kind, dataset, p = case
+    if kind == 'startup':
+        return run_startup(dataset, repeat)
+    data = load_dataset(dataset, p.get('threshold'))
+    best = None
+    for _ in range(repeat):
+        if kind == 'general':
+            from general_colocation.colocation import general
+            start = time.perf_counter()
+            result = general(data, 'pos', 'top_category', 'safegraph_place_id', k=p['k'], theta=p['theta'], alpha=0.5, threshold=p['threshold'])
+            wall = time.perf_counter() - start
+            stats = result.stats.table()
+            phases = stats[stats.phase != 'level'].groupby('phase')['wall'].sum().to_dict()
+            size = {'rows':[int(r) for r in result.rows], 'rules':len(result.R)}
+            if dataset in SYNTHETIC:                                            #check the result against the planted patterns
+                rows, P, R = get_synthetic(dataset, p['threshold']).expected(p['k'], p['theta'], 0.5)
+                found = [{tuple(result.data.labels[list(c)]):v.prevalence for c,v in level.items()} for level in result.prevalent]
+                rules = lambda R: sorted((tuple(r.antecedent), r.consequent, r.p, r.cp) for r in R)
+                size['exact'] = rows == size['rows'] and P == found and rules(R) == rules(result.R)
+        else:
+            sys.path.insert(0, os.path.join(ROOT, 'emergent-colocation'))
+            from colocation import emergent
+            new, old = data[~data['opened_on'].isna()], data[data['opened_on'].isna()]
+            start = time.perf_counter()
+            T, R = emergent(data, new, 'pos', 'brands', 'placekey', 'opened_on', theta=p['theta'], alpha=0.5, threshold=p['threshold'], old_events=old)
+            wall = time.perf_counter() - start
+            phases = {}
+            size = {'rows':[len(T[t]) for t in T], 'rules':len(R)}
+        if best is None or wall < best['wall']:
+            best = dict(wall=wall, phases=phases, **size)
+    best['peak_memory_mb'] = peak_memory_mb()
+    return best
+
+def run(cases, repeat=3):
+    """
+    Run each case in a fresh process so that its peak memory is its own.
+    """
+    results = {}
+    for name, case in cases.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            results[name] = pool.submit(run_case, case, repeat).result()
+        memory = results[name]['peak_memory_mb']
+        print(name+': '+str(round(results[name]['wall'], 4))+'s'+('' if memory is None else ', '+str(round(memory, 1))+' MiB peak'), flush=True)
+    return results
+
+def compare(results, baseline, tolerance=0.2, min_seconds=0.05, min_mb=10, startup_budget=STARTUP_BUDGET):
+    """
+    Compare results to a baseline and return a list of regressions: cases more than tolerance
+    slower (and at least min_seconds), with more than tolerance more peak memory (and at least
+    min_mb), or with a different number of rows or rules, synthetic cases that do not match
+    their planted patterns, and imports that take longer than startup_budget seconds or load
+    plotting or geometry libraries.
+    """
+    out = []
+    for name, r in results.items():
+        if len(r.get('loaded', [])) > 0:
+            out.append(name+': importing the mining modules loads '+', '.join(r['loaded']))
+        if 'loaded' in r and r['wall'] > startup_budget:
+            out.append(name+': import took '+str(round(r['wall'], 3))+'s, more than the budget of '+str(startup_budget)+'s')
+        if r.get('exact') is False:
+            out.append(name+': result differs from the planted patterns')
+        if name not in baseline:
+            continue
+        b = baseline[name]
+        if r['wall'] > b['wall'] * (1 + tolerance) and r['wall'] - b['wall'] > min_seconds:
+            out.append(name+': wall time '+str(round(b['wall'], 4))+'s -> '+str(round(r['wall'], 4))+'s')
+        if r['peak_memory_mb'] is not None and b['peak_memory_mb'] is not None \
+                and r['peak_memory_mb'] > b['peak_memory_mb'] * (1 + tolerance) and r['peak_memory_mb'] - b['peak_memory_mb'] > min_mb:
+            out.append(name+': peak memory '+str(round(b['peak_memory_mb'], 1))+' MiB -> '+str(round(r['peak_memory_mb'], 1))+' MiB')
+        if r['rows'] != b['rows'] or r['rules'] != b['rules']:
+            out.append(name+': result changed, rows '+str(b['rows'])+' -> '+str(r['rows'])+', rules '+str(b['rules'])+' -> '+str(r['rules']))
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark general() and emergent() on the Minneapolis datasets, scaled up copies of them and synthetic data.')
+    parser.add_argument('--quick', action='store_true', help='run a small subset of the cases')
+    parser.add_argument('--cases', default=None, help='only run cases whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each case, the fastest is kept')
+    parser.add_argument('--out', default=os.path.join(HERE, 'results.json'), help='results file to write')
+    parser.add_argument('--baseline', default=os.path.join(HERE, 'baseline.json'), help='results file to compare to')
+    parser.add_argument('--save-baseline', action='store_true', help='also write the results to the baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown or memory growth that counts as a regression')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET, help='seconds that importing the mining modules may take')
+    args = parser.parse_args()
+
+    cases = get_cases(args.quick)
+    if args.cases is not None:
+        cases = {name:case for name,case in cases.items() if args.cases in name}
+    results = run(cases, args.repeat)
+    out = {'created':datetime.now().isoformat(), 'python':platform.python_version(), 'platform':platform.platform(), 'cases':results}
+    with open(args.out, 'w') as f:
+        json.dump(out, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(out, f, indent=1)
+    else:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)['cases']
+        else:
+            print('No baseline at '+args.baseline+', run with --save-baseline first to compare timings')
+        regressions = compare(results, baseline, args.tolerance, startup_budget=args.startup_budget)
+        for r in regressions:
+            print('REGRESSION '+r)
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('No regressions' + (' against '+args.baseline if len(baseline) > 0 else ''))
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,4 @@
 import pandas as pd
-import geopandas as gpd
 
 from emergent import colocate_emergent
 from utils import plot_emergent, emergent_to_gif
@@ -31,11 +30,15 @@ def emergent(data, new_events, position_column, class_column, id_column, time_co
             The minimum participation index for prevalent colocations.
         alpha(float):
             The minimum conditional probability threshold for association rules. 
-        relation(str or function):
+        relation(str, function or PairRelation):
             'meter' and 'unit' are predefined string options, other strings supplied will default to 
-            'meter'. 
+            'meter'. 'meter' is the great-circle (haversine) distance in meters when positions are
+            points with longitude as x and latitude as y, the same relation general() uses.
             If function, should take in two series of positions and a threshold and return a boolean 
             series where True values indicate a spatial relation.
+            A PairRelation object (see relations.py) is instead given the whole position column and
+            the threshold and returns the index pairs of related positions itself, e.g. from a
+            spatial index, so no cross join of positions is needed.
         threshold(int or float):
             The relation threshold passed to the relation function.
         plot(bool):
@@ -74,6 +77,8 @@ def emergent(data, new_events, position_column, class_column, id_column, time_co
 
     T,R = colocate_emergent(old_events, new_events, grouper, theta, alpha, relation, threshold)
     
+    if out_plot or plot:
+        import geopandas as gpd
     if out_plot:
         for time in T:
             plot = plot_emergent(gpd.GeoDataFrame(data, geometry=position_column), T[time], class_column, id_column, time, shape_file, out_plot)
@@ -1,21 +1,24 @@
+import numpy as np
 import pandas as pd
 
 from classes import CascadeRule
+from relations import as_pair_relation
 
 def get_prevalent(T, theta):
-    out = T
     counts = T[['new_cat','new_id']].drop_duplicates()['new_cat'].value_counts()
-    grouped = T.groupby(by=['new_cat','old_cat'])
-    for cats,_ in grouped:
-        group = grouped.get_group(cats)
-        if len(group) < counts[cats[0]] * theta:
-            out = out.drop(group.index)
-    return out
+    sizes = T.groupby(by=['new_cat','old_cat'])['new_id'].transform('size')
+    # a mask rather than dropping by label, since row labels repeat across time steps
+    return T[~(sizes < T['new_cat'].map(counts) * theta)]
 
 def get_colocations(new, old, relation, thold):
-    out = pd.merge(new, old, how='cross')
-    out.loc[:,'relation'] = relation(out['new_pos'],out['old_pos'], thold)
-    out = out[out['relation'] == True].drop(['relation'],axis=1)
+    # new events come first in positions, so only (new, old) pairs are queried
+    positions = np.concatenate([np.asarray(new['new_pos'], dtype=object), np.asarray(old['old_pos'], dtype=object)])
+    left, right = as_pair_relation(relation).cross_pairs(positions, thold, np.arange(len(new)), np.arange(len(new), len(positions)))
+    left, right = np.asarray(left), np.asarray(right)
+    order = np.lexsort((right, left))                                           #same order as a cross merge
+    left, right = left[order], right[order] - len(new)
+    out = pd.concat([new.iloc[left].reset_index(drop=True), old.iloc[right].reset_index(drop=True)], axis=1)
+    out.index = left * len(old) + right                                         #the row labels of a cross merge
     return out
 
 def get_rules(T, alpha):
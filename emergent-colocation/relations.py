@@ -1,26 +1,244 @@
 import numpy as np
-import geopandas as gpd
+import pandas as pd
+
+EARTH_RADIUS_M = 6371008.8
 
 def meters_to_dist(m):
     return m * 25e-6
 
+def get_max_dlon(angle, lat):
+    """
+    The largest longitude difference in radians that two points no further from the equator
+    than the latitudes lat can have while being within angle radians of each other.
+    """
+    c = np.cos(min(np.nanmax(np.abs(lat), initial=0), np.pi/2))
+    if c <= np.sin(angle/2):
+        return np.pi
+    return 2 * np.arcsin(np.sin(angle/2) / c)
+
+def get_deltas(x1, y1, x2, y2):
+    """
+    Latitudes and the latitude and longitude differences in radians of float arrays of
+    longitude (x) and latitude (y) in degrees.
+    """
+    lon1, lat1, lon2, lat2 = np.radians(x1), np.radians(y1), np.radians(x2), np.radians(y2)
+    dlon = np.abs(lon1 - lon2)
+    return lat1, lat2, np.abs(lat1 - lat2), np.minimum(dlon, 2*np.pi - dlon)   #across the antimeridian
+
+def haversine(lat1, lat2, dlat, dlon):
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+def is_within_meters(x1, y1, x2, y2, thold):
+    """
+    Great-circle distance test on float arrays of longitude (x) and latitude (y) in degrees.
+    Pairs outside the latitude and longitude bounding box of thold meters are dropped before
+    the haversine formula is evaluated on the rest.
+    """
+    lat1, lat2, dlat, dlon = get_deltas(x1, y1, x2, y2)
+    angle = thold / EARTH_RADIUS_M
+    near = np.flatnonzero((dlat <= angle) & (dlon <= get_max_dlon(angle, np.concatenate([lat1, lat2]))))
+
+    out = np.zeros(len(lat1), dtype=bool)
+    out[near] = haversine(lat1[near], lat2[near], dlat[near], dlon[near]) < thold
+    return out
+
 def is_spatial_relation_dist_unit(col1,col2,thold):
+    import geopandas as gpd
     col1 = gpd.GeoSeries(col1)
     col2 = gpd.GeoSeries(col2)
     return col1.distance(col2) < thold
 
 def is_spatial_relation_dist_m(col1,col2, thold):
+    import geopandas as gpd
     thold = meters_to_dist(thold)
     s1 = gpd.GeoSeries(col1, crs="EPSG:3857")
     s2 = gpd.GeoSeries(col2, crs="EPSG:3857")
     return s1.distance(s2) < thold
 
+def is_spatial_relation_meter(col1, col2, thold):
+    """
+    Haversine distance in meters for pairs of points with longitude as x and latitude as y,
+    and the distance of is_spatial_relation_dist_m for pairs of other geometries, the same
+    'meter' relation as general_colocation.
+    """
+    import shapely
+    index = getattr(col1, 'index', None)
+    col1 = np.asarray(col1, dtype=object)
+    col2 = np.asarray(col2, dtype=object)
+    points = (shapely.get_type_id(col1) == 0) & (shapely.get_type_id(col2) == 0)
+    out = np.zeros(len(col1), dtype=bool)
+    out[points] = is_within_meters(shapely.get_x(col1[points]), shapely.get_y(col1[points]), shapely.get_x(col2[points]), shapely.get_y(col2[points]), thold)
+    if not points.all():
+        out[~points] = is_spatial_relation_dist_m(col1[~points], col2[~points], thold)
+    return pd.Series(out, index=index)
+
+def as_position_series(positions):
+    """
+    The positions as a GeoSeries if they are all geometries (or missing), like the columns of
+    the merged GeoDataFrames that relation functions were first called on, and as a Series otherwise.
+    """
+    import shapely
+    import geopandas as gpd
+    positions = np.asarray(positions, dtype=object)
+    try:
+        geometries = shapely.is_geometry(positions)
+        if np.any(geometries) and np.all(geometries | shapely.is_missing(positions)):
+            return gpd.GeoSeries(positions)
+    except TypeError:                                                           #positions that are not geometries
+        pass
+    return pd.Series(positions)
+
 def get_relation(relation):
+    if isinstance(relation, PairRelation):
+        return relation
     if(relation == 'meter'):
-            relation = is_spatial_relation_dist_m
+            relation = is_spatial_relation_meter
     elif(relation == 'unit'):
         relation = is_spatial_relation_dist_unit
     else:
         if not callable(relation):
             relation = is_spatial_relation_dist_unit
     return relation
+
+
+def get_search_radius(relation, thold, positions):
+    """
+    The distance in coordinate units a spatial index must search to find every pair the
+    relation may accept, or None if the relation cannot use a spatial index.
+    """
+    if relation is is_spatial_relation_meter:
+        import shapely
+        angle = thold / EARTH_RADIUS_M
+        positions = np.asarray(positions, dtype=object)
+        points = shapely.get_type_id(positions) == 0
+        lat = np.radians(shapely.get_y(positions[points]))
+        radius = np.degrees(np.hypot(angle, get_max_dlon(angle, lat)))         #corner of the bounding box of is_within_meters
+        if not points.all():
+            return max(radius, meters_to_dist(thold))
+        return radius
+    if relation is is_spatial_relation_dist_m:
+        return meters_to_dist(thold)
+    elif relation is is_spatial_relation_dist_unit:
+        return thold
+    return None
+
+class PairRelation:
+    """
+    A relation that is given the whole column of positions and returns the related pairs
+    itself, for example by querying a spatial index, instead of testing two aligned series
+    of a cross join. Subclasses implement pairs.
+    """
+    def pairs(self, positions, thold, rows=None):
+        """
+        Args:
+            positions(array-like):
+                The position of every event.
+            thold(int or float):
+                The relation threshold.
+            rows(array-like or None):
+                If specified, only pairs with left in rows are needed. Other pairs may still
+                be returned and are dropped by the caller.
+
+        Returns:
+            left, right: integer arrays of positional indexes into positions of every related
+            pair, each pair once with left < right
+        """
+        raise NotImplementedError
+
+    def radius(self, positions, thold):
+        """
+        An optional hint: the distance in coordinate units beyond which no two positions are
+        related, or None.
+        """
+        return None
+
+    def cross_pairs(self, positions, thold, rows, others):
+        """
+        The related pairs between two disjoint groups of positions, such as new and old events.
+        The default keeps the pairs of pairs() with right in others.
+        Args:
+            positions(array-like):
+                The position of every event.
+            thold(int or float):
+                The relation threshold.
+            rows(array-like):
+                Positional indexes of the first group.
+            others(array-like):
+                Positional indexes of the second group, each after every index of rows.
+
+        Returns:
+            left, right: integer arrays of positional indexes into positions of every related
+            pair with left in rows and right in others
+        """
+        left, right = self.pairs(positions, thold, rows)
+        left, right = np.asarray(left), np.asarray(right)
+        keep = np.isin(left, rows) & np.isin(right, others)
+        return left[keep], right[keep]
+
+class ElementwiseRelation(PairRelation):
+    """
+    Adapter that gives a relation function, which takes two aligned series of positions and
+    a threshold and returns a boolean series, the pair query interface. Candidate pairs come
+    from a spatial index for the predefined relations and from every pair otherwise.
+    """
+    def __init__(self, relation) -> None:
+        self.relation = relation
+
+    def radius(self, positions, thold):
+        return get_search_radius(self.relation, thold, positions)
+
+    def pairs(self, positions, thold, rows=None):
+        positions = np.asarray(positions, dtype=object)
+        rows = np.arange(len(positions)) if rows is None else np.asarray(rows)
+        radius = self.radius(positions, thold)
+        if radius is not None:
+            import geopandas as gpd
+            left, right = gpd.GeoSeries(positions).sindex.query(positions[rows], predicate='dwithin', distance=radius)
+            left = rows[left]
+        else:
+            left, right = np.repeat(rows, len(positions)), np.tile(np.arange(len(positions)), len(rows))
+        keep = left < right
+        left, right = left[keep], right[keep]
+        keep = self.related(positions, left, right, thold)
+        return left[keep], right[keep]
+
+    def cross_pairs(self, positions, thold, rows, others):
+        positions = np.asarray(positions, dtype=object)
+        rows, others = np.asarray(rows), np.asarray(others)
+        radius = self.radius(positions, thold)
+        if radius is not None:
+            import geopandas as gpd
+            left, right = gpd.GeoSeries(positions[others]).sindex.query(positions[rows], predicate='dwithin', distance=radius)
+            chunks = [(rows[left], others[right])]
+        else:
+            chunks = cross_chunks(rows, others)
+        out_left, out_right = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for left, right in chunks:
+            keep = self.related(positions, left, right, thold)
+            out_left.append(left[keep])
+            out_right.append(right[keep])
+        return np.concatenate(out_left), np.concatenate(out_right)
+
+    def related(self, positions, left, right, thold):
+        """
+        Whether each pair (left[i], right[i]) of positional indexes is related.
+        """
+        if len(left) == 0:
+            return np.zeros(0, dtype=bool)
+        return np.asarray(self.relation(as_position_series(positions[left]), as_position_series(positions[right]), thold), dtype=bool)
+
+def cross_chunks(rows, others, chunk_size=1000000):
+    """
+    Enumerate every pair of a position of rows and a position of others in chunks of about
+    chunk_size pairs, for relations that cannot use a spatial index.
+    """
+    step = max(1, chunk_size // max(len(others), 1))
+    for start in range(0, len(rows), step):
+        left = rows[start:start+step]
+        yield np.repeat(left, len(others)), np.tile(others, len(left))
+
+def as_pair_relation(relation):
+    if isinstance(relation, PairRelation):
+        return relation
+    return ElementwiseRelation(relation)
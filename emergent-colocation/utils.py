@@ -1,10 +1,8 @@
-import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point
-import matplotlib.pyplot as plt
-import imageio
 import os
 
+# geopandas, matplotlib and imageio are only imported once something is plotted
+
 def adjust_bounds(bounds):
     xmin, ymin, xmax, ymax = bounds
     plot_ratio = 1.5
@@ -31,6 +29,9 @@ def adjust_bounds(bounds):
     return xmin, ymin, xmax, ymax
 
 def plot_emergent(E, T, class_column, id_column, title, shape_file, out=None):
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
+    from shapely.geometry import Point
     ids = pd.unique(T[['new_id','old_id']].values.ravel('K'))
     to_plot = E[E[id_column].isin(ids)]
 
@@ -67,6 +68,7 @@ def plot_emergent(E, T, class_column, id_column, title, shape_file, out=None):
     return plt
 
 def emergent_to_gif(png_dir):
+    import imageio
     frames_per_plot = 10
     files = []
     for (_,_, filenames) in os.walk(png_dir):
@@ -0,0 +1,70 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from general_colocation.files import atomic_write
+
+def describe_value(value):
+    """
+    A description of an attribute of a relation object that does not depend on memory
+    addresses: arrays are hashed by their bytes, since numpy shortens the repr of long arrays,
+    and functions and objects are described like relations.
+    """
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest())
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(describe_value(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((repr(k), describe_value(v)) for k,v in value.items()))
+    if callable(value) or hasattr(value, '__dict__'):
+        return describe_relation(value)
+    return repr(value)
+
+def describe_relation(relation):
+    """
+    The module and name of a relation function, or of the class and the pickled attributes of a
+    relation object, which stay the same from one run to the next.
+    """
+    if hasattr(relation, '__qualname__'):
+        return (getattr(relation, '__module__', None), relation.__qualname__)
+    state = relation.__getstate__() if hasattr(relation, '__getstate__') else None
+    if not isinstance(state, dict):
+        state = getattr(relation, '__dict__', {})
+    return (type(relation).__module__, type(relation).__qualname__, describe_value(state))
+
+def fingerprint(D, relation, thold, theta, alpha, spill_dir, top_n=None, sample=None):
+    """
+    A hash of the encoded data, the relation and the parameters that change which
+    colocations and rules are found at each k value (theta, alpha, top_n and the sample),
+    plus the spill directory that spilled table instances are stored in.
+    """
+    h = hashlib.sha256(pd.util.hash_pandas_object(D.table, index=False).values.tobytes())
+    h.update(repr((describe_relation(relation), thold, theta, alpha, spill_dir, top_n, sample)).encode())
+    return h.hexdigest()
+
+def save_checkpoint(path, k, key, level):
+    """
+    Write the candidates, prevalent colocations, table instance and rules of one k value.
+    """
+    os.makedirs(path, exist_ok=True)
+    with atomic_write(os.path.join(path, 'k'+str(k)+'.pkl')) as f:
+        pickle.dump((key, level), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_checkpoint(path, key, first, last):
+    """
+    Load the levels k=first,...,last that were completed by an earlier run, stopping at the first
+    missing level. Raises a ValueError if the checkpoint was written for different data or
+    parameters.
+    """
+    levels = []
+    for k in range(first, last+1):
+        fname = os.path.join(path, 'k'+str(k)+'.pkl')
+        if not os.path.exists(fname):
+            break
+        with open(fname, 'rb') as f:
+            saved_key, level = pickle.load(f)
+        if saved_key != key:
+            raise ValueError('The checkpoint in '+path+' was written for different data, relation, threshold, theta or alpha')
+        levels.append(level)
+    return levels
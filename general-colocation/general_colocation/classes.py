@@ -11,10 +11,22 @@ class Rule:
         return '{'+', '.join(self.antecedent)+'} => '+str(self.consequent)+' ('+str(round(self.p, 4))+', '+str(round(self.cp, 4))+')'
 
 class Colocation:
-    def __init__(self, items, t, prevalence) -> None:
+    def __init__(self, items, t, prevalence, interval=None) -> None:
         self.items = items
         self.table_instance = t
         self.prevalence = prevalence
+        self.interval = interval
         self.size = len(t)
     def __str__(self) -> str:
-        return ', '.join(self.items)+': '+str(self.size)+' items, p='+str(self.prevalence)
\ No newline at end of file
+        return ', '.join(self.items)+': '+str(self.size)+' items, p='+str(self.prevalence)
+class Level:
+    def __init__(self, k, candidates, prevalent, rules, table_instance, rows) -> None:
+        self.k = k
+        self.candidates = candidates
+        self.prevalent = prevalent
+        self.rules = rules
+        self.table_instance = table_instance
+        self.rows = rows
+    def __str__(self) -> str:
+        k = str(self.k)
+        return '|C'+k+'| = '+str(len(self.candidates))+', |P'+k+'| = '+str(len(self.prevalent))+', |R'+k+'| = '+str(len(self.rules))+', Rows in T'+k+' = '+str(self.rows)
@@ -1,12 +1,16 @@
+import os
+import argparse
 import pandas as pd
-import geopandas as gpd
 
-from general_colocation.general import colocate
+from general_colocation.general import colocate, colocate_sweep, iter_colocate
 from general_colocation.utils import plot_table_instance
 from general_colocation.relations import get_relation
+from general_colocation.stats import MiningStats
+from general_colocation.loading import load_encoded
 
 def general(data, position_column, class_column, id_column, k=3, theta=0.6, alpha=0.5, 
-            relation='meter', threshold=100, plot=False, shape_file=None, out_plot=None, out_csv=None):
+            relation='meter', threshold=100, plot=False, shape_file=None, out_plot=None, out_csv=None, engine='join', workers=1, tiles=None, spill_dir=None, checkpoint_dir=None, top_n=None, maximal=False,
+            sample=None, confidence=0.95, verify=False, verbose=False, callback=None, trace_memory=False, pair_cache=None):
     """
     Find prevalent k-itemsets of features satisfying a defined minimum participation 
     index and spatial relationship. Configurable to show plots of prevalent colocations
@@ -27,11 +31,17 @@ def general(data, position_column, class_column, id_column, k=3, theta=0.6, alph
             The minimum participation index for prevalent colocations.
         alpha(float):
             The minimum conditional probability threshold for association rules. 
-        relation(str or function):
+        relation(str, function or PairRelation):
             'meter' and 'unit' are predefined string options, other strings supplied will default to 
             'meter'. 
+            'meter' is the haversine distance in meters for points with longitude as x and latitude
+            as y, computed on their float coordinates. Other geometries use an approximate
+            distance in degrees.
             If function, should take in two series of positions and a threshold and return a boolean 
             series where True values indicate a spatial relation.
+            A PairRelation object (see relations.py) is instead given the whole position column and
+            the threshold and returns the index pairs of related positions itself, e.g. from a
+            spatial index, so no cross join of positions is needed.
         threshold(int or float):
             The relation threshold passed to the relation function.
         plot(bool):
@@ -45,43 +55,239 @@ def general(data, position_column, class_column, id_column, k=3, theta=0.6, alph
             If specified, .png files with colocation plots 
             for each k value will be stored here.
         out_csv(string or None):
-            If specified, table instances of prevalent colocations for each
-            k value will be stored here and accessed for computing k+1 colocations. For
-            large datasets or large k values this option will help memory management.
+            If specified, the table instance of colocations of size k will be stored here as
+            a .csv file. See spill_dir to keep table instances on disk during computation.
+        engine(string):
+            default 'join'. How table instances of size 3 and up are generated. 'join' merges
+            the (k-1) table instance with itself and tests the relation on the last items.
+            'joinless' extends (k-1) instances with the neighborhoods found for size 2, so no
+            merges or relation tests are done after size 2. Both return the same T and R.
+        workers(int):
+            default 1. If greater than 1, each k value is split by the class of the first item
+            of each colocation and mined across this many processes. The result is the same as
+            a serial run. A user-defined relation must be picklable (e.g. a module level function).
+        tiles(int or None):
+            If specified, neighbors of size 2 are found by splitting the bounding box of the data
+            into a tiles x tiles grid and indexing one tile plus a threshold wide halo at a time,
+            which bounds the memory of the spatial index for very large datasets. Prevalence is
+            still computed over the whole dataset. Only used with the 'meter' and 'unit' relations
+            and with PairRelation objects that give a radius.
+        spill_dir(string or None):
+            If specified, table instances for each k value are written here as .npy files of
+            whole classes of the first item, about a million rows each, as soon as they are
+            computed and are memory-mapped to compute k+1 colocations. Only one partition is
+            loaded at a time, so for large datasets or large k values this option will help
+            memory management. The star neighborhoods of the joinless engine are memory-mapped
+            from here too. T is then read back from these files one k value at a time when it
+            is indexed.
+        checkpoint_dir(string or None):
+            If specified, the candidates, prevalent colocations, table instance and rules of
+            each k value are saved here once computed. A later call with the same data, relation,
+            threshold, theta and alpha resumes after the last saved k value instead of starting
+            over. A ValueError is raised if the saved checkpoint does not match these inputs.
+            With spill_dir, a table instance is saved as the paths of its spilled files, which
+            must still be there to resume.
+        top_n(int or None):
+            If specified, only the top_n most prevalent colocations of each size from 2 up are
+            returned (colocations tied with the last one are returned too) and theta becomes a
+            lower bound, so theta=0 needs no prevalence threshold at all. Candidates are bounded
+            by the participation index of their subsets, and those bounded below the top_n-th
+            best colocation of their size are skipped without generating their instances.
+        maximal(bool):
+            default False. If True, only prevalent colocations without a prevalent superset of
+            size up to k, their table instances and their rules are returned. Colocations are
+            dropped as soon as a larger prevalent colocation contains them. Cannot be used with
+            top_n.
+        sample(int or None):
+            If specified, participation indices are estimated from a random sample of up to this
+            many feature instances of each class instead of counted over all instances. Each
+            prevalent colocation then has a confidence interval, see result.summary(). Only the
+            table instances holding a sampled feature instance are generated and returned in T,
+            and conditional probabilities are estimated over them.
+        confidence(float):
+            default 0.95. The confidence level of the intervals of a sampled run.
+        verify(bool):
+            default False. If True, colocations of a sampled run whose confidence interval
+            contains theta are counted exactly, so only clear cases are decided by the sample.
+            Each is counted by searching the neighborhoods of all instances of one of its classes.
+        verbose(bool):
+            default False. If True, the number of candidates, prevalent colocations, rules and
+            table instance rows of each k value are printed with the elapsed time.
+        callback(function or None):
+            If specified, called with a PhaseStats (see stats.py) for each phase of each k value
+            as soon as it is mined, with its wall time, CPU time, peak memory and rows.
+        trace_memory(bool):
+            default False. If True, the peak memory of each phase is traced with tracemalloc,
+            which makes mining somewhat slower. Otherwise peak memory is None.
+        pair_cache(string or None):
+            If specified, a directory of related pairs shared between runs. The pairs of the
+            positions, relation and threshold are read from it (memory-mapped) instead of found
+            with a spatial search, or found once and saved there. Runs over the same positions
+            with another k, theta, alpha or class_column reuse them. A user-defined relation is
+            told apart by its module and name, so change its name along with its behavior.
 
     Returns:
+        A ColocationResult that unpacks to T, R. Call result.extend(k) to mine larger colocations
+        later on without computing k values 1,...,k again.
+        Call result.select(theta, alpha) for the T, R of a higher theta and alpha.
+        result.stats.table() has the time, memory and rows of each phase of each k value.
         T: A list of pandas DataFrames with prevalent colocations, one for each k value 1,...,k
         R: A list of Rule objects (e.g. {A,B} => C (prevalence, conditional probability))
     """
     relation = get_relation(relation)
 
     # T is the table instance for k-colocations, R is the set of all colocation rules for k=1,...,k
-    T,R = colocate(data, position_column, class_column, id_column, k, theta, alpha, relation, threshold)
+    result = colocate(data, position_column, class_column, id_column, k, theta, alpha, relation, threshold, engine, workers, tiles, spill_dir, checkpoint_dir, top_n, maximal, sample, confidence, verify,
+                      pair_cache, MiningStats(callback, verbose, trace_memory))
+    T,R = result
     
+    if out_plot or plot:
+        import geopandas as gpd
     if out_plot:
         for i in range(len(T)):
-            plot = plot_table_instance(gpd.GeoDataFrame(data, geometry=position_column), T, class_column, id_column, shape_file, out_plot, k=i+1)
+            plot = plot_table_instance(gpd.GeoDataFrame(data, geometry=position_column), T, class_column, id_column, i+1, shape_file, out_plot)
             if plot is not None:
                 plot.close()
     if plot:
-        last_plot = plot_table_instance(gpd.GeoDataFrame(data, geometry=position_column), T, class_column, id_column, shape_file, out_plot, k=len(T))
+        last_plot = plot_table_instance(gpd.GeoDataFrame(data, geometry=position_column), T, class_column, id_column, len(T), shape_file, out_plot)
         last_plot.show(block=True)
     if out_csv:
         T[-1].drop(columns=['pos'+str(k)]).to_csv(out_csv+'/k'+str(k)+'.csv', index=False)
 
-    return T,R
+    return result
 
-def main():
+def iter_general(data, position_column, class_column, id_column, k=3, theta=0.6, alpha=0.5,
+                 relation='meter', threshold=100, engine='join', workers=1, tiles=None, spill_dir=None, checkpoint_dir=None,
+                 sample=None, confidence=0.95, verify=False, verbose=False, callback=None, trace_memory=False, pair_cache=None):
+    """
+    Find prevalent k-itemsets and association rules one set size at a time. Each size is
+    yielded as soon as it is mined, so results can be written or shown before the larger
+    sizes are done, and each size is released from memory once the next one is found.
+    Args:
+        data, position_column, class_column, id_column, k, theta, alpha, relation, threshold,
+        engine, workers, tiles, spill_dir, checkpoint_dir, sample, confidence, verify, verbose, callback,
+        trace_memory, pair_cache:
+            As in general.
+
+    Returns:
+        A generator of Level objects for k values 1,...,k, stopping early if no colocations of
+        a k value are prevalent. Each Level has:
+        candidates: A set of candidate colocations as tuples of classes
+        prevalent: A dictionary of the participation index of each prevalent colocation
+        rules: A set of Rule objects for the colocations of this k value
+        table_instance: A pandas DataFrame with the instances of prevalent colocations
+    """
+    relation = get_relation(relation)
+    return iter_colocate(data, position_column, class_column, id_column, k, theta, alpha, relation, threshold, engine, workers, tiles, spill_dir, checkpoint_dir, sample, confidence, verify,
+                         pair_cache, MiningStats(callback, verbose, trace_memory))
+
+def sweep(data, position_column, class_column, id_column, thresholds, k=3, theta=0.6, alpha=0.5,
+          relation='meter', engine='join', workers=1):
+    """
+    Find prevalent k-itemsets and association rules for several relation thresholds at once.
+    Neighbor pairs are found a single time at the largest threshold, and each smaller threshold
+    keeps the pairs whose distance is below it, so no spatial search is repeated.
+    Args:
+        data(pandas.DataFrame):
+            Ratings or other data you wish to partition.
+        position_column(string):
+            The DataFrame column with positions.
+        class_column(string):
+            The DataFrame column with feature classes.
+        id_column(string):
+            The DataFrame column with feature ids.
+        thresholds(list of int or float):
+            The relation thresholds to mine, e.g. [50, 100, 200].
+        k, theta, alpha, relation, engine, workers:
+            As in general. A user-defined relation that gives no distances is tested again on
+            the pairs of the largest threshold for each smaller one.
+
+    Returns:
+        results: A dictionary of ColocationResults by threshold, each unpacking to T, R
+        summary: A pandas DataFrame with the threshold, k, colocation, participation index and
+            number of instances of every prevalent colocation of size 2 and up
+    """
+    relation = get_relation(relation)
+    return colocate_sweep(data, position_column, class_column, id_column, k, theta, alpha, relation, thresholds, engine, workers)
+
+def toy_example():
+    import geopandas as gpd
     d = {'x':[1,2,2,3,4,6],'y':[3,1,5,3,5,1],'class':['solid_sq','empty_ci','empty_ci','solid_ci','dotted_sq','dotted_sq'],'id':[1,1,2,1,1,2]}
     data = pd.DataFrame(data=d)
     data['pos'] = gpd.points_from_xy(data.x,data.y)
 
-    T,R = general(data, 'pos','class','id',relation='unit',threshold=2.3)
+    T,R = general(data, 'pos','class','id',relation='unit',threshold=2.3,verbose=True)
 
     print('\n',T[-1],'\n')
     
     for r in R:
         print(r)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='colocation', description='Mine colocation patterns and association rules from a .csv or .parquet '
+                                     'file of points. Runs a toy example if no input file is given.')
+    parser.add_argument('input', nargs='?', help='.csv or .parquet file with one row for each feature instance')
+    parser.add_argument('--class-column', default='top_category', help='column with feature classes (default top_category)')
+    parser.add_argument('--id-column', default='safegraph_place_id', help='column with feature ids (default safegraph_place_id)')
+    parser.add_argument('--lat-column', default='latitude', help='column with latitudes (default latitude)')
+    parser.add_argument('--lon-column', default='longitude', help='column with longitudes (default longitude)')
+    parser.add_argument('-k', type=int, default=3, help='largest colocation size (default 3)')
+    parser.add_argument('--theta', type=float, default=0.6, help='minimum participation index (default 0.6)')
+    parser.add_argument('--alpha', type=float, default=0.5, help='minimum conditional probability of rules (default 0.5)')
+    parser.add_argument('--relation', default='meter', choices=['meter','unit'], help='spatial relation (default meter)')
+    parser.add_argument('--threshold', type=float, default=100, help='relation threshold (default 100)')
+    parser.add_argument('--engine', default='join', choices=['join','joinless'], help='how table instances are generated (default join)')
+    parser.add_argument('--workers', type=int, default=1, help='processes to mine each k value with (default 1)')
+    parser.add_argument('--tiles', type=int, help='split the neighbor search into a tiles x tiles grid')
+    parser.add_argument('--spill-dir', help='directory to keep table instances in as .npy files')
+    parser.add_argument('--checkpoint-dir', help='directory to save each k value in and resume from')
+    parser.add_argument('--top-n', type=int, help='keep only the top n most prevalent colocations of each size')
+    parser.add_argument('--maximal', action='store_true', help='keep only maximal prevalent colocations')
+    parser.add_argument('--sample', type=int, help='estimate participation from a sample of this many instances of each class')
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence level of a sampled run (default 0.95)')
+    parser.add_argument('--verify', action='store_true', help='count borderline colocations of a sampled run exactly')
+    parser.add_argument('--pair-cache', help='directory of related pairs to reuse across runs over the same points')
+    parser.add_argument('--cache', help='sidecar file for the encoded input (default next to the input file)')
+    parser.add_argument('--no-cache', action='store_true', help='parse the input file without reading or writing a sidecar')
+    parser.add_argument('--out', help='directory to write rules.csv, summary.csv, stats.csv and the table instance of each k value to')
+    parser.add_argument('--verbose', action='store_true', help='print the sizes and time of each k value')
+    return parser.parse_args(argv)
+
+def write_results(result, out):
+    """
+    Write the rules, the prevalent colocations, the phase statistics and the table instance of
+    each k value from 2 up (without positions) of a ColocationResult to the directory out.
+    """
+    os.makedirs(out, exist_ok=True)
+    T, R = result
+    rules = sorted(R, key=lambda r: (len(r.items), r.antecedent, r.consequent))
+    pd.DataFrame([(' & '.join(r.antecedent), r.consequent, r.p, r.cp) for r in rules],
+                 columns=['antecedent','consequent','prevalence','probability']).to_csv(os.path.join(out, 'rules.csv'), index=False)
+    summary = result.summary()
+    summary['colocation'] = summary['colocation'].map(' & '.join)
+    summary.to_csv(os.path.join(out, 'summary.csv'), index=False)
+    result.stats.table().to_csv(os.path.join(out, 'stats.csv'), index=False)
+    for k in range(2, len(T)+1):
+        T[k-1].drop(columns=['pos'+str(k)]).to_csv(os.path.join(out, 'k'+str(k)+'.csv'), index=False)
+
+def main(argv=None):
+    """
+    The colocation command. With an input file, its points are read (or loaded from the sidecar
+    of an earlier run), mined with the given parameters and the rules are printed, see
+    colocation --help. Without one, the toy example is run.
+    """
+    args = parse_args(argv)
+    if args.input is None:
+        toy_example()
+        return
+    D = load_encoded(args.input, args.class_column, args.id_column, args.lat_column, args.lon_column, False if args.no_cache else args.cache)
+    result = colocate(D, None, None, None, args.k, args.theta, args.alpha, get_relation(args.relation), args.threshold, args.engine, args.workers, args.tiles,
+                      args.spill_dir, args.checkpoint_dir, args.top_n, args.maximal, args.sample, args.confidence, args.verify, args.pair_cache,
+                      MiningStats(verbose=args.verbose))
+    if args.out:
+        write_results(result, args.out)
+    for r in sorted(result.R, key=lambda r: (len(r.items), r.antecedent, r.consequent)):
+        print(r)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from general_colocation.classes import Rule
+
+class EncodedData:
+    """
+    Feature instances with classes and ids dictionary-encoded to small integers. Rows are
+    sorted by class, so the order of class codes matches the order of class labels and a
+    table instance of size k is an integer array with one row per instance and one column
+    of row positions for each item. codes can give the (classes, labels, instances,
+    class_counts) of rows of E that are already sorted by class and encoded, e.g. read from a
+    sidecar by load_encoded, so they are not encoded again.
+    """
+    def __init__(self, E, pos_column, class_column, id_column, codes=None) -> None:
+        self.table = E[[class_column,id_column,pos_column]].rename(columns={class_column:'cat1',id_column:'id1',pos_column:'pos1'})
+        if codes is None:
+            self.table = self.table.sort_values(by='cat1')
+        self.ids = self.table['id1'].values
+        self.positions = self.table['pos1'].values
+        if codes is not None:
+            self.classes, self.labels, self.instances, self.class_counts = codes
+            return
+        classes, labels = pd.factorize(self.table['cat1'], sort=True)
+        self.labels = np.asarray(labels, dtype=object)
+        self.classes = classes.astype(np.int32)                                         # -1 for a missing class
+        self.instances = self.table.groupby(['cat1','id1'], sort=False, dropna=False).ngroup().values.astype(np.int32)
+
+        _, first = np.unique(self.instances, return_index=True)                          # one row for each distinct (class, id)
+        first = first[self.classes[first] >= 0]
+        self.class_counts = np.bincount(self.classes[first], minlength=len(self.labels))
+
+    def __len__(self) -> int:
+        return len(self.classes)
+
+def row_keys(A, bases):
+    """
+    One int64 key for each row of a non-negative integer array, in the order of the rows, where
+    column j holds values below bases[j]. The keys so far are replaced by their ranks whenever
+    the next column would overflow them, so any number of columns fits.
+    """
+    keys, bound = np.zeros(len(A), dtype=np.int64), 1
+    for j, base in enumerate(np.broadcast_to(bases, A.shape[1:]).tolist()):
+        if bound * base >= 2**63:
+            ranks, keys = np.unique(keys, return_inverse=True)
+            keys, bound = keys.ravel().astype(np.int64), len(ranks)
+        keys = keys * base + A[:,j]
+        bound *= base
+    return keys
+
+def get_patterns(D, I):
+    classes = D.classes[I]
+    keys = row_keys(classes + 1, len(D.labels) + 1)                                    # +1 for a missing class
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return [tuple(p) for p in classes[first].tolist()], inverse.ravel()               # class codes of each colocation and the colocation of each instance
+
+def decode_table_instance(D, I):
+    k = I.shape[1]
+    if k == 1:
+        return D.table.iloc[I[:,0]]
+    out = {}
+    for i in range(1,k+1):
+        out['cat'+str(i)] = D.labels[D.classes[I[:,i-1]]]
+        out['id'+str(i)] = D.ids[I[:,i-1]]
+    out['pos'+str(k)] = D.positions[I[:,-1]]
+    return pd.DataFrame(out)
+
+def decode_items(D, items):
+    return tuple(D.labels[list(items)])
+
+def decode_rules(D, R):
+    return set(Rule(decode_items(D, r.antecedent), D.labels[r.consequent], r.p, r.cp) for r in R)
@@ -0,0 +1,19 @@
+import os
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_write(fname):
+    """
+    Open a binary file to write fname through. It is written under a temporary name and then
+    renamed, so that an interrupted run never leaves a partial file behind, and a run reading
+    fname sees either the old file or the whole new one.
+    """
+    tmp = fname + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            yield f
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, fname)
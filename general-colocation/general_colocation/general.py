@@ -1,93 +1,732 @@
-from builtins import isinstance
+import os
+import time
+import heapq
+from itertools import combinations
+import numpy as np
 import pandas as pd
-import geopandas as gpd
 from datetime import datetime
-from general_colocation.utils import generate_supersets, generate_subsets
-from general_colocation.classes import Rule, Colocation
+from concurrent.futures import ProcessPoolExecutor
+from general_colocation.utils import generate_prefix_joins
+from general_colocation.classes import Rule, Colocation, Level
+from general_colocation.encoding import EncodedData, get_patterns, row_keys, decode_table_instance, decode_items, decode_rules
+from general_colocation.neighbors import related_pairs, concat_ranges
+from general_colocation.relations import as_pair_relation, PairList
+from general_colocation.checkpoint import fingerprint, save_checkpoint, load_checkpoint
+from general_colocation.paircache import cached_pairs
+from general_colocation.sampling import InstanceSample, Neighborhoods
+from general_colocation.stats import MiningStats
+from general_colocation.spill import PartitionWriter, spill_star_neighborhoods, read_instances, read_table_instance, map_instances, unmap_instances, SpilledTables
 
-def generate_table_instances(C, T, P, k, relation, thold):
+def get_candidate_keys(D, C, patterns, j=1):
+    pattern_ids = {p:i for i,p in enumerate(patterns)}                          #candidates by their pattern without the j-th last item and its class
+    rest = [(c, c[:-j] + c[len(c)-j+1:]) for c in C]
+    return np.array([pattern_ids[p] * len(D.labels) + c[-j] for c,p in rest if p in pattern_ids], dtype=np.int64)
+
+def is_related(D, left, right, relation, thold):
+    return np.asarray(as_pair_relation(relation).related(D.positions, left, right, thold), dtype=bool)
+
+def generate_pair_instances(D, relation, thold, rows=None, tiles=None):
+    chunks = related_pairs(D.positions, as_pair_relation(relation), thold, rows, tiles)
+    queried = np.zeros(len(D), dtype=bool)
+    queried[np.arange(len(D)) if rows is None else rows] = True
+    out = [np.zeros((0,2), dtype=np.int32)]
+    for left, right in chunks:
+        left, right = np.asarray(left), np.asarray(right)
+        keep = queried[left]
+        left, right = left[keep], right[keep]
+        swap = D.classes[left] > D.classes[right]                              #orient each pair so that cat1 < cat2
+        left, right = np.where(swap, right, left), np.where(swap, left, right)
+        keep = (D.classes[left] >= 0) & (D.classes[left] < D.classes[right])
+        out.append(np.column_stack([left[keep], right[keep]]).astype(np.int32))
+    I = np.concatenate(out)
+    return I[np.lexsort((I[:,1], I[:,0]))]                                      #instances are sorted by row position of each item
+
+def generate_table_instances(C, I, D, P, k, relation, thold, tiles=None, stats=None):
+    stats = MiningStats() if stats is None else stats
     if k == 2:
-        out = pd.merge(T, T.rename(columns={'cat1':'cat2','id1':'id2','pos1':'pos2'}), how='cross')
-    else:
-        tup_list = list(zip(*T[['cat'+str(i) for i in range(1,k)]].values.T))       #list of category combinations of size k
-        T_tmp = T[[t in P for t in tup_list]]                                       #only check prevalent combinations
-        
-        T_tmp1 = T_tmp.rename(columns={'cat' + str(k-1):'cat' + str(k),'id' + str(k-1):'id' + str(k),'pos' + str(k-1):'pos' + str(k)})
-        out = pd.merge(T_tmp, T_tmp1, on=['id'+str(i) for i in range(1,k-1)]+['cat'+str(i) for i in range(1,k-1)])
-
-        tup_list = list(zip(*out[['cat'+str(i) for i in range(1,k+1)]].values.T))   #new list of category combinations of size k+1
-        out = out[[t in C for t in tup_list]]                                       #only keep combinations in the new candidate set
-
-    out = out[out['cat'+str(k-1)] < out['cat'+str(k)]]
-    out.loc[:,'relation'] = relation(out['pos'+str(k-1)],out['pos'+str(k)], thold)
-    out = out[out['relation'] == True].drop(['relation','pos'+str(k-1)],axis=1)
-    return out
+        with stats.phase(k, 'relation') as phase:
+            t_new = generate_pair_instances(D, relation, thold, I[:,0], tiles)
+            phase.rows = len(t_new)
+        return t_new
+
+    with stats.phase(k, 'join') as phase:
+        left, right = join_instances(C, I, D, P, k)
+        phase.rows = len(left)
+    with stats.phase(k, 'relation') as phase:
+        keep = is_related(D, I[left,-1], I[right,-1], relation, thold)
+        phase.rows = int(keep.sum())
+    return np.column_stack([I[left[keep]], I[right[keep],-1]])
+
+def join_instances(C, I, D, P, k):
+    patterns, inverse = get_patterns(D, I)
+    prevalent = np.array([p in P for p in patterns], dtype=bool)
+    rows = np.flatnonzero(prevalent[inverse])                                   #only check prevalent combinations
+
+    prefix = I[rows,:k-2]
+    starts = np.flatnonzero(np.r_[True, np.any(prefix[1:] != prefix[:-1], axis=1)])
+    ends = np.repeat(np.r_[starts[1:], len(rows)], np.diff(np.r_[starts, len(rows)]))
+    counts = ends - np.arange(len(rows)) - 1                                    #join each instance with later instances sharing its prefix
+    left = np.repeat(np.arange(len(rows)), counts)
+    right = concat_ranges(np.arange(1, len(rows)+1), counts)
+    left, right = rows[left], rows[right]
+
+    keys = inverse[left].astype(np.int64) * len(D.labels) + D.classes[I[right,-1]]
+    keep = np.isin(keys, get_candidate_keys(D, C, patterns))                    #only keep combinations in the new candidate set
+    return left[keep], right[keep]
+
+def generate_star_neighborhoods(D, I):
+    indptr = np.searchsorted(I[:,0], np.arange(len(D)+1))
+    return indptr, I[:,1], I[:,0].astype(np.int64) * len(D) + I[:,1]
+
+def generate_joinless_instances(C, I, D, P, k, stars):
+    indptr, neighbors, pair_keys = stars
+    patterns, inverse = get_patterns(D, I)
+    prevalent = np.array([p in P for p in patterns], dtype=bool)
+    rows = np.flatnonzero(prevalent[inverse])
+
+    last = I[rows,-1]
+    counts = indptr[last+1] - indptr[last]                                      #extend each instance by the star neighborhood of its last item
+    new = neighbors[concat_ranges(indptr[last], counts)]
+    rows = np.repeat(rows, counts)
+
+    keys = inverse[rows].astype(np.int64) * len(D.labels) + D.classes[new]
+    keep = np.isin(keys, get_candidate_keys(D, C, patterns))                    #only keep combinations in the new candidate set
+    for j in range(k-2):                                                        #new item must neighbor every other item in the instance
+        keys = I[rows,j].astype(np.int64) * len(D) + new
+        found = np.searchsorted(pair_keys, keys)
+        keep &= pair_keys[np.minimum(found, len(pair_keys)-1)] == keys
+    return np.column_stack([I[rows[keep]], new[keep]])
+
+def generate_sampled_instances(C, I, D, P, k, neighborhoods, relation, thold, mask, stats=None):
+    """
+    The instances of size k that hold a sampled feature instance, from those of size k-1. If
+    the first k-1 items of an instance hold a sampled item, it extends them by a neighbor of
+    that item with a larger class than their last item. Otherwise its last item is the only
+    sampled one, and a neighbor of it is inserted before it in the instance without its second
+    to last item. Each instance is found once, and only neighbors of sampled items are searched.
+    """
+    stats = MiningStats() if stats is None else stats
+    indptr, neighbors = neighborhoods.indptr, neighborhoods.neighbors
+    with stats.phase(k, 'join') as phase:
+        patterns, inverse = get_patterns(D, I)
+        prevalent = np.array([p in P for p in patterns], dtype=bool)
+        rows = np.flatnonzero(prevalent[inverse])
+        sampled = mask[D.instances[I[rows]]]
+        inner = sampled[:,:-1].any(axis=1)
+        anchor = np.argmax(sampled, axis=1)                                     #column of the first sampled item, to extend through
+        x = I[rows, anchor]
+        counts = indptr[x+1] - indptr[x]
+        new = neighbors[concat_ranges(indptr[x], counts)]
+        rows, anchor, inner = np.repeat(rows, counts), np.repeat(anchor, counts), np.repeat(inner, counts)
+
+        classes = D.classes[new]
+        keys = inverse[rows].astype(np.int64) * len(D.labels) + classes
+        after = np.isin(keys, get_candidate_keys(D, C, patterns)) & (classes > D.classes[I[rows,-1]])
+        before = np.isin(keys, get_candidate_keys(D, C, patterns, 2)) & (classes > D.classes[I[rows,-2]]) & (classes < D.classes[I[rows,-1]])
+        before &= ~inner & ~mask[D.instances[new]]                              #insert before the only sampled item
+        keep = after | before
+        rows, anchor, before, new = rows[keep], anchor[keep], before[keep], new[keep]
+        phase.rows = len(rows)
+    with stats.phase(k, 'relation') as phase:
+        keep = np.ones(len(rows), dtype=bool)
+        for j in range(k-1):                                                    #new item must neighbor every other item in the instance
+            test = np.flatnonzero(keep & (anchor != j))
+            keep[test] = is_related(D, I[rows[test],j], new[test], relation, thold)
+        rows, before, new = rows[keep], before[keep], new[keep]
+        phase.rows = len(rows)
+    out = np.column_stack([I[rows], new])
+    out[before,-2:] = out[before,:-3:-1]
+    return out[np.lexsort(out.T[::-1])]                                         #instances are sorted by row position of each item
+
+def count_participation(D, patterns, relation, thold, neighborhoods):
+    """
+    The exact participation counts of a few colocations, e.g. the borderline ones of a sample.
+    Each colocation is anchored at one of its classes, one that anchors another colocation or
+    else the one with the fewest rows not searched yet, since every instance holds an item of
+    each class. Only the rows of anchor classes are added to neighborhoods, and instances of the
+    colocations and their subsets that hold an anchor row are generated like those of a sample.
+    """
+    k = len(patterns[0])
+    L = len(D.labels)
+    unsearched = np.bincount(D.classes[~neighborhoods.searched & (D.classes >= 0)], minlength=L)
+    anchors = set()
+    for p in patterns:
+        if anchors.isdisjoint(p):
+            anchors.add(min(p, key=lambda c: unsearched[c]))
+    rows = np.flatnonzero(np.isin(D.classes, list(anchors)))
+    neighborhoods.search(D, relation, thold, rows)
+    mask = np.zeros(D.instances.max()+1, dtype=bool)
+    mask[D.instances[rows]] = True
+    subsets = [set(s for p in patterns for s in combinations(p, i)) for i in range(k+1)]
+    I = generate_pair_instances(D, neighborhoods.pairs(rows), thold)
+    I = I[np.isin(D.classes[I[:,0]].astype(np.int64) * L + D.classes[I[:,1]], [a * L + b for a,b in subsets[2]])]
+    for i in range(3, k+1):
+        I = generate_sampled_instances(subsets[i], I, D, subsets[i-1], i, neighborhoods, relation, thold, mask)
+    found, inverse = get_patterns(D, I)
+    counts = get_participation(D, I, inverse, len(found))
+    index = {p:i for i,p in enumerate(found)}
+    return np.array([counts[index[p]] if p in index else np.zeros(k) for p in patterns])
 
 def generate_candidate_colocation(P, k):
     out = set()
-    c = set(generate_supersets(P[k-1].values(), k))
-    for candidate in c:
-        kminusone_sets = generate_subsets(candidate, k)  # generate list of unique k subsets
-        if kminusone_sets.issubset(P[k-1].keys()):
-            out.update([candidate])
+    for candidate in generate_prefix_joins(P[k-1].keys()):
+        # the two joined k subsets are prevalent, check the ones missing an item of the shared prefix
+        if all(candidate[:i] + candidate[i+1:] in P[k-1] for i in range(k-1)):
+            out.add(candidate)
     return out
-       
-def select_prevalent(thold, T, k, cat_count):
+
+def candidate_bounds(P, C):
+    """
+    An upper bound of the participation index of each candidate: the lowest participation index
+    of its subsets one item smaller, since no colocation is more prevalent than its subsets.
+    """
+    return {c:min(P[c[:i] + c[i+1:]].prevalence for i in range(len(c))) for c in C}
+
+def get_participation(D, I, inverse, n, mask=None):
+    counts = np.zeros((n, I.shape[1]))
+    for j in range(I.shape[1]):                                                 #distinct instances of each class in each colocation
+        instances = D.instances[I[:,j]]
+        rows = np.arange(len(I)) if mask is None else np.flatnonzero(mask[instances])
+        distinct = np.unique(inverse[rows].astype(np.int64) * len(D) + instances[rows])
+        counts[:,j] = np.bincount(distinct // len(D), minlength=n)
+    return counts
+
+def select_prevalent(thold, I, D, sample=None, exact=None):
     out = {}
-    grouped = T.groupby(['cat'+str(i) for i in range(1,k+1)])
-    for colocation, _ in grouped:
-        group = grouped.get_group(colocation)
-        participation_indices = [len(group['id'+str(i)].unique()) / cat_count[colocation[i-1]] for i in range(1, k+1)]
-        prevalence = min(participation_indices)
-        if prevalence >= thold :
-            out[colocation] = Colocation(colocation, group, prevalence)
+    patterns, inverse = get_patterns(D, I)
+    classes = np.array(patterns, dtype=np.int64).reshape(len(patterns), I.shape[1])
+    if sample is None:
+        prevalence = (get_participation(D, I, inverse, len(patterns)) / D.class_counts[classes]).min(axis=1)
+        lower = upper = prevalence
+    else:
+        prevalence, lower, upper = sample.estimate(D, get_participation(D, I, inverse, len(patterns), sample.mask), classes)
+        borderline = np.flatnonzero((lower < thold) & (upper >= thold))
+        if exact is not None and len(borderline) > 0:                           #count colocations whose interval contains thold exactly
+            counts = exact([patterns[i] for i in borderline])
+            prevalence[borderline] = lower[borderline] = upper[borderline] = (counts / D.class_counts[classes[borderline]]).min(axis=1)
+    keep = np.flatnonzero(prevalence >= thold)
+
+    order = np.argsort(inverse, kind='stable')
+    groups = np.split(order, np.cumsum(np.bincount(inverse, minlength=len(patterns)))[:-1])
+    for i in keep:
+        out[patterns[i]] = Colocation(patterns[i], I[groups[i]], prevalence[i], None if sample is None else (lower[i], upper[i]))
     return out
 
-def generate_rules(min_cp, T, P, k):
+def generate_rules(min_cp, P, sizes, D, mask=None):
     rules = set()
-    for p in P:
-        for item in p:
-            antecedent = list(p)
-            cat_indexes = [j for j in range(1,k+2)]
-            cat_indexes.remove(p.index(item)+1)
-            antecedent.remove(item)
-            antecedent = tuple(antecedent) if len(antecedent) > 1 else antecedent[0]
-            Tk = T[k].groupby(['cat'+str(i+1) for i in range(k+1)])
-            Tkminus1 = T[k-1].groupby(['cat'+str(i+1) for i in range(k)])
-            num = len(Tk.get_group(p).drop_duplicates(subset=['id'+str(index) for index in cat_indexes]))
-            cp = num / len(Tkminus1.get_group(antecedent))
+    if len(P) == 0:
+        return rules
+    I = np.concatenate([c.table_instance for c in P.values()])                 #only instances of prevalent colocations
+    pattern_ids = np.repeat(np.arange(len(P)), [c.size for c in P.values()])
+    instances = D.instances[I]
+    bases = [len(P)] + [int(D.instances.max()) + 1] * (I.shape[1] - 1)
+    for j in range(I.shape[1]):
+        antecedents = np.column_stack([pattern_ids, np.delete(instances, j, axis=1)])
+        if mask is not None:                                                    #a sampled antecedent instance, like those counted in sizes
+            antecedents = antecedents[mask[antecedents[:,1:]].any(axis=1)]
+        _, first = np.unique(row_keys(antecedents, bases), return_index=True)
+        counts = np.bincount(antecedents[first,0], minlength=len(P))            #distinct antecedent instances of each colocation
+        for p, num in zip(P, counts):
+            antecedent = p[:j] + p[j+1:]
+            cp = num / sizes[antecedent]                                        #antecedents of prevalent colocations are prevalent
             if cp > min_cp:
-                antecedent = (antecedent,) if isinstance(antecedent,str) else antecedent
-                rules.update([Rule(antecedent, item, P[p].prevalence, cp)])
+                rules.add(Rule(antecedent, p[j], P[p].prevalence, cp))
     return rules
 
-def colocate(E, pos_column, class_column, id_column, K, theta, alpha, relation, thold):
-    ET = E[[class_column,id_column]].drop_duplicates()[class_column].value_counts()
-    start = datetime.now()
-    k = 1
-    p_new = {(e,):Colocation((e,), E[E[class_column]==e], 1) for e,_ in ET.iteritems()}
-    c_new = set([(e,) for e,_ in ET.iteritems()])
-    t_new = E[[class_column,id_column,pos_column]].rename(columns={class_column:'cat1',id_column:'id1',pos_column:'pos1'}).sort_values(by='cat1')
-    r_new = set()
-
-    C = [c_new] # Candidate locations
-    P = [p_new] # Prevalent locations
-    T = [t_new] # Table instances
-    R = r_new # Co-location rules
-
-    while((len(p_new) > 0) and k < K):
-        print('|C'+str(k)+'| = '+str(len(c_new))+', |P'+str(k)+'| = '+str(len(p_new))+', |R'+str(k)+'| = '+str(len(r_new))+', Rows in T'+str(k)+' = '+str(len(t_new))+', Elapsed Time: '+str(datetime.now()-start))
-        c_new = generate_candidate_colocation(P, k)
-        t_new = generate_table_instances(c_new, T[k-1], p_new, k+1, relation, thold)
-        p_new = select_prevalent(theta, t_new, k+1, ET)
-
-        T.append(t_new)
-        r_new = generate_rules(alpha, T, p_new, k)
-
-        C.append(c_new)
-        P.append(p_new)
-        R.update(r_new)
-        k += 1
-
-    print('|C'+str(k)+'| = '+str(len(c_new))+', |P'+str(k)+'| = '+str(len(p_new))+', |R'+str(k)+'| = '+str(len(r_new))+', Rows in T'+str(k)+' = '+str(len(t_new))+', Elapsed Time: '+str(datetime.now()-start))
-    return T, R
\ No newline at end of file
+def mine_level(C, I, D, P, sizes, k, theta, alpha, relation, thold, engine, stars, tiles, sample=None, stats=None, pairs=None):
+    stats = MiningStats() if stats is None else stats
+    if sample is not None and k > 1:
+        t_new = generate_sampled_instances(C, I, D, P, k+1, stars, relation, thold, sample.mask, stats)
+    elif engine == 'joinless' and k > 1:
+        with stats.phase(k+1, 'join') as phase:
+            t_new = generate_joinless_instances(C, I, D, P, k+1, stars)
+            phase.rows = len(t_new)
+    else:
+        t_new = generate_table_instances(C, I, D, P, k+1, pairs if k == 1 and pairs is not None else relation, thold, tiles, stats)   #size 2 uses the pair cache if there is one
+    exact = None
+    if sample is not None and sample.verify:
+        exact = lambda patterns: count_participation(D, patterns, relation, thold, stars)
+    with stats.phase(k+1, 'prevalence') as phase:
+        p_new = select_prevalent(theta, t_new, D, sample, exact)
+        phase.rows = len(t_new)
+    with stats.phase(k+1, 'rules') as phase:
+        r_new = generate_rules(alpha, p_new, sizes, D, None if sample is None else sample.mask)
+        phase.rows = sum(c.size for c in p_new.values())
+    return t_new, p_new, r_new
+
+def partition_instances(D, I, parts):
+    first = D.classes[I[:,0]]
+    cuts = np.flatnonzero(first[1:] != first[:-1]) + 1                          #instances are only split where the class of the first item changes
+    if parts < 2 or len(cuts) == 0:
+        return [I]
+    targets = np.arange(1, parts) * len(I) / parts
+    cuts = np.unique(cuts[np.minimum(np.searchsorted(cuts, targets), len(cuts)-1)])
+    return np.split(I, cuts)
+
+worker_state = None
+
+def init_worker(D, relation, pairs, stars, thold=None):
+    """
+    Keep the data, the relation, the cached pairs of size 2 and the star neighborhoods in a
+    worker process, so they are sent once rather than with every partition, and build the
+    spatial index of the relation once if size 2 is still to be mined (thold is given).
+    """
+    global worker_state
+    worker_state = (D, relation, pairs, stars)
+    if thold is not None:
+        relation.prepare(D.positions, thold)
+
+def mine_partition(args, shared=None):
+    C, I, P, sizes, k, theta, alpha, thold, engine, tiles, sample, memory = args
+    D, relation, pairs, stars = worker_state if shared is None else shared
+    stats = MiningStats(memory=memory)                                          #merged into the stats of the run by the main process
+    return mine_level(C, read_instances(I), D, P, sizes, k, theta, alpha, relation, thold, engine, stars, tiles, sample, stats, pairs) + (stats.records,)
+
+class ColocationResult:
+    """
+    The result of colocate. Unpacks to T, R like a tuple, and keeps the encoded table
+    instances and prevalent colocations of each k value so that extend can mine larger
+    k values without computing the smaller ones again.
+
+    With top_n, only the top_n most prevalent colocations of each size from 2 up are returned.
+    Each k value keeps a heap of its best participation indices. Its candidates are ranked by
+    the lowest participation index of their subsets, an upper bound of their own, and the
+    top_n best ranked are mined first to fill the heap. Candidates whose bound is below the
+    top_n-th best index found are then skipped without generating their instances. A skipped
+    colocation could still be a subset of a top colocation of a larger k value, so if one of
+    them is bounded at or above the top_n-th best index of a larger k value, the k value it
+    was skipped from is mined again with that index as the most it may skip at, along with the
+    k values after it.
+
+    With maximal, only prevalent colocations without a prevalent superset are kept. Once the
+    next k value is mined, the colocations it extends are dropped along with their table
+    instances, so subsumed colocations only stay in memory while they are needed.
+
+    With sample, participation indices are estimated from an InstanceSample of each class and
+    each prevalent colocation has a confidence interval. Only the instances that hold a sampled
+    feature instance are generated, so instances holds those alone and conditional probabilities
+    are estimated over the sampled instances of each antecedent. With verify, colocations whose
+    interval contains the prevalence threshold are counted exactly by searching the
+    neighborhoods of all instances of one of their classes.
+
+    With keep_levels=False, each level is released once the next one is added, since mining
+    k+1 only needs the table instance and prevalent colocations of k. T then only holds the
+    last table instance (None for the others) and R only the rules of the last k value.
+
+    With pair_cache, the related pairs of size 2 are read from a cache directory shared by runs
+    over the same positions, relation and threshold (see paircache.py) instead of searched for.
+
+    The time, memory and rows of each phase of each k value are recorded in stats, a MiningStats.
+    """
+    def __init__(self, D, theta, alpha, relation, thold, engine='join', workers=1, tiles=None, spill_dir=None, checkpoint_dir=None, top_n=None, maximal=False,
+                 sample=None, confidence=0.95, verify=False, pair_cache=None, keep_levels=True, stats=None) -> None:
+        if top_n is not None and maximal:
+            raise ValueError('top_n and maximal cannot be used together')
+        self.data = D
+        self.theta = theta
+        self.alpha = alpha
+        self.relation = relation
+        self.pair_relation = as_pair_relation(relation)                        #keeps its spatial index between partitions
+        self.thold = thold
+        self.engine = engine
+        self.workers = workers
+        self.tiles = tiles
+        self.spill_dir = spill_dir
+        self.checkpoint_dir = checkpoint_dir
+        self.top_n = top_n
+        self.maximal = maximal
+        self.sample = InstanceSample(D, sample, confidence, verify) if sample is not None else None
+        self.pair_cache = pair_cache
+        self.keep_levels = keep_levels
+        self.stats = MiningStats() if stats is None else stats
+        self.heaps = [[]]              # The top_n best participation indices of each k value
+        self.skipped = [float('-inf')] # The highest bound of the candidates skipped at each k value
+        self.floors = {}                                                        #the most each k value may skip at, lowered when a larger k value needs its colocations
+        self.stars = None
+        self.pairs = None                                                       #related pairs read from pair_cache
+        self.pool = None
+
+        t_new = np.arange(len(D), dtype=np.int32).reshape(-1, 1)
+        p_new = {(c,):Colocation((c,), t_new[D.classes == c], 1) for c in range(len(D.labels))}
+        if spill_dir is not None:
+            writer = PartitionWriter(os.path.join(spill_dir, 'k1'), D)
+            writer.add(t_new, p_new)
+            t_new = writer.close()
+        self.candidates = [set(p_new)] # Candidate locations
+        self.prevalent = [p_new]       # Prevalent locations
+        self.instances = [t_new]       # Encoded table instances
+        self.rules = [set()]           # Encoded co-location rules of each k value
+        self.rows = [len(D)]           # Rows in each table instance
+        self.key = fingerprint(D, relation, thold, theta, alpha, spill_dir, top_n, (sample, confidence, verify) if sample is not None else None) if checkpoint_dir is not None else None
+
+    @property
+    def k(self):
+        return len(self.prevalent)
+
+    def level_cutoff(self, k):
+        """
+        The lowest participation index returned for size k+1: theta, or the top_n-th best
+        participation index of size k+1 once there are top_n of them.
+        """
+        if self.top_n is not None and len(self.heaps[k]) >= self.top_n:
+            return max(self.theta, self.heaps[k][0])
+        return self.theta
+
+    def top(self, k):
+        """
+        The prevalent colocations of size k+1 at or above level_cutoff.
+        """
+        cutoff = self.level_cutoff(k)
+        return {p:c for p,c in self.prevalent[k].items() if c.prevalence >= cutoff}
+
+    def maximal_instances(self, k, P=None):
+        """
+        The rows of the table instance of size k+1 that belong to maximal colocations, or to the
+        colocations of P if it is given.
+        """
+        P = self.prevalent[k] if P is None else P
+        I = self.instances[k] if self.spill_dir is None else read_table_instance(self.instances[k], k+1)
+        if len(I) == 0:
+            return I
+        patterns, inverse = get_patterns(self.data, I)
+        return I[np.array([p in P for p in patterns], dtype=bool)[inverse]]
+
+    @property
+    def T(self):
+        if self.top_n is not None:
+            return [decode_table_instance(self.data, self.maximal_instances(k, self.top(k))) for k in range(self.k)]
+        if self.maximal:
+            return [decode_table_instance(self.data, self.maximal_instances(k)) for k in range(self.k)]
+        if self.spill_dir is not None:
+            return SpilledTables(self.data, self.instances)
+        return [decode_table_instance(self.data, I) if I is not None else None for I in self.instances]
+
+    @property
+    def R(self):
+        if self.top_n is not None:
+            return decode_rules(self.data, set(r for k,R in enumerate(self.rules) for r in R if r.items in self.top(k)))
+        if self.maximal:
+            return decode_rules(self.data, set(r for k,R in enumerate(self.rules) for r in R if r.items in self.prevalent[k]))
+        return decode_rules(self.data, set().union(*self.rules))
+
+    def __iter__(self):
+        return iter((self.T, self.R))
+
+    def __getitem__(self, i):
+        return (self.T, self.R)[i]
+
+    def __len__(self) -> int:
+        return 2
+
+    def report(self, start):
+        if not self.stats.verbose:
+            return
+        k = self.k
+        print('|C'+str(k)+'| = '+str(len(self.candidates[-1]))+', |P'+str(k)+'| = '+str(len(self.prevalent[-1]))+', |R'+str(k)+'| = '+str(len(self.rules[-1]))+', Rows in T'+str(k)+' = '+str(self.rows[-1])+', Elapsed Time: '+str(datetime.now()-start))
+
+    def extend(self, k):
+        """
+        Mine colocations of size k from the levels already found, computing only the k values
+        that are missing. Does nothing if k is not larger than the current k or if no colocations
+        of the current k value are prevalent. Returns the result itself.
+        """
+        for _ in self.mine(k):
+            pass
+        return self
+
+    def level(self, k):
+        """
+        The decoded Level of colocations of size k: its candidates, the participation index of
+        each prevalent colocation, its rules and its table instance.
+        """
+        D = self.data
+        I = self.instances[k-1] if self.spill_dir is None else read_table_instance(self.instances[k-1], k)
+        return Level(k, set(decode_items(D, c) for c in self.candidates[k-1]),
+                     {decode_items(D, p):c.prevalence for p,c in self.prevalent[k-1].items()},
+                     decode_rules(D, self.rules[k-1]), decode_table_instance(D, I), self.rows[k-1])
+
+    def mine(self, k):
+        """
+        A generator form of extend that yields the size of each new level as soon as it is added.
+        """
+        D = self.data
+        start = datetime.now()
+        if self.checkpoint_dir is not None:
+            for c_new, p_new, t_new, r_new, rows in load_checkpoint(self.checkpoint_dir, self.key, self.k+1, k):  #resume after the last completed k value
+                if self.spill_dir is not None:                                  #spilled table instances are checkpointed as their files
+                    for part in t_new:
+                        map_instances(part, p_new, D)
+                if self.engine == 'joinless' and self.sample is None and self.k == 1:
+                    self.stars = self.star_neighborhoods(t_new, rows)
+                self.add_level(c_new, p_new, t_new, r_new, rows)
+                yield self.k
+
+        if self.pair_cache is not None and self.k == 1 and len(self.prevalent[-1]) > 0 and self.k < k:
+            with self.stats.phase(2, 'relation'):
+                self.pairs = cached_pairs(D, self.relation, self.thold, self.pair_cache, self.tiles)
+        if self.sample is not None and self.stars is None and len(self.prevalent[-1]) > 0 and self.k < k:
+            with self.stats.phase(2, 'relation'):
+                rows = np.flatnonzero(self.sample.mask[D.instances])
+                self.stars = Neighborhoods(len(D), self.pairs)                  #neighbors of the sampled rows, and later of verified classes
+                self.stars.search(D, self.pair_relation, self.thold, rows)
+                self.pairs = self.stars.pairs(rows)
+        if self.workers > 1 and len(self.prevalent[-1]) > 0 and self.k < k:
+            self.pool = self.start_pool()
+        try:
+            yield from self.mine_levels(k, start)
+            j = self.incomplete_level()
+            while j is not None:                                                #mine again the k values that skipped too much
+                self.truncate(j)
+                yield from self.mine_levels(k, start)
+                j = self.incomplete_level()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.pool = None
+        self.report(start)
+
+    def star_neighborhoods(self, t_new, rows):
+        """
+        The star neighborhoods of the table instance of size 2, memory-mapped from the spill
+        directory when spilling.
+        """
+        if self.spill_dir is None:
+            return generate_star_neighborhoods(self.data, t_new)
+        return spill_star_neighborhoods(os.path.join(self.spill_dir, 'stars'), self.data, t_new, rows)
+
+    def start_pool(self):
+        """
+        A process pool whose workers are given the data, relations and star neighborhoods once
+        by init_worker, and build the spatial index once if size 2 is still to be mined.
+        """
+        thold = self.thold if self.k == 1 and self.pairs is None else None
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(self.data, self.pair_relation, self.pairs, self.stars, thold))
+
+    def mine_levels(self, k, start):
+        D = self.data
+        while((len(self.prevalent[-1]) > 0) and self.k < k):
+            self.report(start)
+            K = self.k
+            wall, cpu = time.perf_counter(), time.process_time()
+            with self.stats.phase(K+1, 'candidates') as phase:
+                c_new = generate_candidate_colocation(self.prevalent, K)
+                phase.rows = len(c_new)
+            if self.top_n is not None:
+                c_new = self.top_candidates(c_new, K)
+            writer = PartitionWriter(os.path.join(self.spill_dir, 'k'+str(K+1)), D) if self.spill_dir is not None else None
+            t_new, p_new, r_new, rows = self.mine_candidates(c_new, K, writer)
+            if self.engine == 'joinless' and self.sample is None and K == 1:
+                self.stars = self.star_neighborhoods(t_new, rows)
+            self.add_level(c_new, p_new, t_new, r_new, rows)
+            if self.pool is not None and self.engine == 'joinless' and self.sample is None and K == 1 and self.k < k:
+                self.pool.shutdown()                                            #workers get the star neighborhoods once too
+                self.pool = self.start_pool()
+            if self.checkpoint_dir is not None:
+                save_checkpoint(self.checkpoint_dir, K+1, self.key, (c_new, p_new if self.spill_dir is None else unmap_instances(p_new), t_new, r_new, rows))
+            self.stats.level(K+1, time.perf_counter() - wall, time.process_time() - cpu, rows)
+            yield self.k
+
+    def mine_candidates(self, c_new, K, writer=None):
+        """
+        The table instance, prevalent colocations, rules and number of rows of the candidates
+        c_new of size K+1, mined over the partitions of the table instance of size K. Spilled
+        table instances are written with writer, and not kept if it is None.
+        """
+        D = self.data
+        p_prev = self.prevalent[-1]
+        sizes = {p:c.size for p,c in p_prev.items()}
+        if self.sample is not None and K == 1:                                  #antecedents are counted among sampled instances
+            sizes = {p:self.sample.counts[p[0]] for p in p_prev}
+        if self.top_n is not None and K > 1:                                    #only join the instances of subsets of the candidates
+            p_prev = {p:p_prev[p] for c in c_new for p in (c[:-1], c[:-2] + c[-1:])}
+        params = (K, self.theta, self.alpha, self.thold, self.engine, self.tiles, self.sample, self.stats.memory)
+        # partitions hold whole colocations and are merged in order, so the result matches a serial run
+        if self.spill_dir is not None:
+            parts = self.instances[-1]                                          #spilled files of whole classes of the first item
+        elif self.pool is not None:
+            parts = partition_instances(D, self.instances[-1], self.workers)
+        else:
+            parts = [self.instances[-1]]
+        if self.pool is None:
+            shared = (D, self.pair_relation, self.pairs, self.stars)
+            results = (mine_partition((c_new, I, p_prev, sizes) + params, shared) for I in parts)
+        else:
+            results = self.pool.map(mine_partition, [(c_new, I, set(p_prev), sizes) + params for I in parts])
+        t_new, p_new, r_new, rows = [], {}, set(), 0
+        for t_part, p_part, r_part, records in results:
+            self.stats.merge(records)
+            rows += len(t_part)
+            if self.spill_dir is None:
+                t_new.append(t_part)
+            elif writer is not None and len(t_part) > 0:
+                writer.add(t_part, p_part)
+            p_new.update(p_part)
+            r_new.update(r_part)
+        if self.spill_dir is None:
+            t_new = np.concatenate(t_new) if len(t_new) > 1 else t_new[0]
+        else:
+            t_new = writer.close() if writer is not None else None
+        return t_new, p_new, r_new, rows
+
+    def top_candidates(self, C, K):
+        """
+        The candidates of size K+1 that can be among its top_n most prevalent colocations. The
+        top_n candidates with the highest bound (and those tied with them) are mined first, and
+        candidates whose bound is below the top_n-th best participation index among them, or
+        below the floor of K+1, are left out.
+        """
+        bounds = candidate_bounds(self.prevalent[-1], C)
+        ranked = sorted(bounds.values(), reverse=True)
+        if len(ranked) <= self.top_n or ranked[self.top_n-1] == ranked[-1]:    #the first candidates mined would be all of them
+            return C
+        first = set(c for c in C if bounds[c] >= ranked[self.top_n-1])
+        best = heapq.nlargest(self.top_n, [c.prevalence for c in self.mine_candidates(first, K)[1].values()])
+        cutoff = best[-1] if len(best) >= self.top_n else self.theta
+        cutoff = min(cutoff, self.floors.get(K, float('inf')))
+        return set(c for c in C if bounds[c] >= cutoff)
+
+    def incomplete_level(self):
+        """
+        The smallest k value (as an index of the levels) that skipped a candidate bounded at or
+        above the lowest participation index returned for a larger k value, after lowering its
+        floor to that index, or None if no k value did.
+        """
+        out = None
+        for i in range(2, self.k):
+            cutoff = self.level_cutoff(i)
+            for j in range(1, i):
+                if self.skipped[j] >= cutoff:
+                    self.floors[j] = min(self.floors.get(j, float('inf')), cutoff)
+                    out = j if out is None else min(out, j)
+        return out
+
+    def truncate(self, k):
+        """
+        Drop the levels of size k+1 and up so that they can be mined again.
+        """
+        for levels in [self.candidates, self.prevalent, self.instances, self.rules, self.rows, self.heaps, self.skipped]:
+            del levels[k:]
+
+    def select(self, theta=None, alpha=None):
+        """
+        T, R for a theta and alpha at least as high as the ones mined, taken from the participation
+        indices and conditional probabilities already found without testing any relations again.
+        Mine once at the lowest theta and alpha of interest and select the others from the result.
+        """
+        if self.maximal or not self.keep_levels:
+            raise ValueError('A different theta or alpha cannot be selected from a maximal result or one without all levels')
+        theta = self.theta if theta is None else theta
+        alpha = self.alpha if alpha is None else alpha
+        if theta < self.theta or alpha < self.alpha:
+            raise ValueError('Only a theta of at least '+str(self.theta)+' and an alpha of at least '+str(self.alpha)+' can be selected from this result')
+        if theta <= max(self.skipped):
+            raise ValueError('Only a theta above '+str(max(self.skipped))+', the highest bound of a candidate skipped by top_n, can be selected from this result')
+        D = self.data
+        T = [self.instances[0] if self.spill_dir is None else read_table_instance(self.instances[0], 1)]
+        P = [self.prevalent[0]]
+        R = set()
+        for k in range(1, len(self.instances)):
+            I = self.instances[k] if self.spill_dir is None else read_table_instance(self.instances[k], k+1)
+            if k > 1:                                                           #instances of candidates that a run at theta would generate
+                patterns, inverse = get_patterns(D, I)
+                C = generate_candidate_colocation(P, k)
+                I = I[np.array([p in C for p in patterns], dtype=bool)[inverse]] if len(I) > 0 else I
+            T.append(I)
+            P.append({p:c for p,c in self.prevalent[k].items() if c.prevalence >= theta})
+            R.update(r for r in self.rules[k] if r.p >= theta and r.cp > alpha)
+            if len(P[-1]) == 0:
+                break
+        return [decode_table_instance(D, I) for I in T], decode_rules(D, R)
+
+    def summary(self):
+        """
+        One row for each prevalent colocation of size 2 and up with its participation index, the
+        bounds of its confidence interval (equal to the index unless it was estimated from a
+        sample) and its number of instances.
+        """
+        rows = []
+        for k in range(2, self.k+1):
+            for c in self.top(k-1).values():
+                lower, upper = (c.prevalence, c.prevalence) if c.interval is None else c.interval
+                rows.append((k, decode_items(self.data, c.items), c.prevalence, lower, upper, c.size))
+        return pd.DataFrame(rows, columns=['k','colocation','prevalence','lower','upper','instances'])
+
+    def add_level(self, c_new, p_new, t_new, r_new, rows):
+        heap = []
+        skipped = float('-inf')
+        if self.top_n is not None:
+            for c in p_new.values():
+                if len(heap) < self.top_n:
+                    heapq.heappush(heap, c.prevalence)
+                elif c.prevalence > heap[0]:
+                    heapq.heapreplace(heap, c.prevalence)
+            left_out = generate_candidate_colocation(self.prevalent, self.k) - c_new #candidates whose instances were not generated
+            skipped = max(candidate_bounds(self.prevalent[-1], left_out).values(), default=skipped)
+        if self.maximal:
+            subsumed = set(p[:i] + p[i+1:] for p in p_new for i in range(len(p)))
+            for p in subsumed.intersection(self.prevalent[-1]):
+                del self.prevalent[-1][p]
+            if self.spill_dir is None:                                          #free the table instances of subsumed colocations
+                self.instances[-1] = self.maximal_instances(len(self.instances)-1)
+        self.candidates.append(c_new)
+        self.prevalent.append(p_new)
+        self.instances.append(t_new)
+        self.rules.append(r_new)
+        self.rows.append(rows)
+        self.heaps.append(heap)
+        self.skipped.append(skipped)
+        if not self.keep_levels:                                                #only the last level is needed to mine the next one
+            self.candidates[-2], self.prevalent[-2], self.instances[-2], self.rules[-2] = set(), {}, None, set()
+
+def colocate(E, pos_column, class_column, id_column, K, theta, alpha, relation, thold, engine='join', workers=1, tiles=None, spill_dir=None, checkpoint_dir=None, top_n=None, maximal=False,
+             sample=None, confidence=0.95, verify=False, pair_cache=None, stats=None):
+    """
+    Returns a ColocationResult, which unpacks to T, R. Call its extend method to mine a larger k
+    later on without computing k=1,...,K again. E can also be an EncodedData (e.g. from
+    load_encoded), which is used as it is.
+    """
+    D = E if isinstance(E, EncodedData) else EncodedData(E, pos_column, class_column, id_column)
+    return ColocationResult(D, theta, alpha, relation, thold, engine, workers, tiles, spill_dir, checkpoint_dir, top_n, maximal, sample, confidence, verify, pair_cache, stats=stats).extend(K)
+
+def iter_colocate(E, pos_column, class_column, id_column, K, theta, alpha, relation, thold, engine='join', workers=1, tiles=None, spill_dir=None, checkpoint_dir=None,
+                  sample=None, confidence=0.95, verify=False, pair_cache=None, stats=None):
+    """
+    A generator form of colocate that yields a Level for each k=1,...,K as soon as it is mined.
+    Each level is released once the next one is done, so only two levels are in memory at a time.
+    top_n and maximal are not available here since they revisit earlier levels.
+    """
+    D = E if isinstance(E, EncodedData) else EncodedData(E, pos_column, class_column, id_column)
+    result = ColocationResult(D, theta, alpha, relation, thold, engine, workers, tiles, spill_dir, checkpoint_dir, None, False, sample, confidence, verify, pair_cache, keep_levels=False, stats=stats)
+    yield result.level(1)
+    for k in result.mine(K):
+        yield result.level(k)
+
+def colocate_sweep(E, pos_column, class_column, id_column, K, theta, alpha, relation, tholds, engine='join', workers=1):
+    """
+    Mine colocations for each threshold in tholds while finding neighbor pairs only once, at
+    the largest threshold. The pairs of each smaller threshold are the ones whose distance
+    is below it, or that still pass the relation if it gives no distances. Returns a dictionary
+    of ColocationResults by threshold and a summary DataFrame from summarize_sweep.
+    """
+    D = E if isinstance(E, EncodedData) else EncodedData(E, pos_column, class_column, id_column)
+    relation = as_pair_relation(relation)
+    I = generate_pair_instances(D, relation, max(tholds))
+    distances = relation.distances(D.positions, I[:,0], I[:,1])
+
+    results = {}
+    for thold in sorted(set(tholds)):
+        if distances is not None:
+            keep = np.asarray(distances) < thold
+        else:
+            keep = np.asarray(relation.related(D.positions, I[:,0], I[:,1], thold), dtype=bool)
+        pairs = PairList(I[keep,0], I[keep,1])                                  #later k values test relations against these pairs
+        results[thold] = ColocationResult(D, theta, alpha, pairs, thold, engine, workers).extend(K)
+    return results, summarize_sweep(results)
+
+def summarize_sweep(results):
+    """
+    One row for each prevalent colocation of size 2 and up at each threshold, from the summary
+    of each result. Counts of patterns per threshold are summary.groupby(['threshold','k']).size().
+    """
+    columns = ['threshold','k','colocation','prevalence','lower','upper','instances']
+    return pd.concat([pd.DataFrame(columns=columns)] + [result.summary().assign(threshold=thold)[columns] for thold, result in results.items()], ignore_index=True)
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from general_colocation.encoding import EncodedData
+from general_colocation.files import atomic_write
+
+CACHE_VERSION = 1
+
+def read_points(path, class_column, id_column, lat_column='latitude', lon_column='longitude', position_column='pos'):
+    """
+    Read feature instances from a .csv or .parquet file. Only the class, id, latitude and
+    longitude columns are read, classes and ids as strings and coordinates as floats, and rows
+    missing any of them are dropped. The positions are built from the coordinates in one step
+    as points with longitude as x and latitude as y, for the 'meter' relation.
+    Returns a DataFrame with the four columns and the position column.
+    """
+    import geopandas as gpd
+    columns = [id_column, class_column, lat_column, lon_column]
+    dtypes = {class_column:str, id_column:str, lat_column:np.float64, lon_column:np.float64}
+    if os.path.splitext(path)[1].lower() in ('.parquet', '.pq'):
+        data = pd.read_parquet(path, columns=columns).dropna()
+        data = data.astype(dtypes)                                              #after dropna so missing values are not cast to 'nan'
+    else:
+        data = pd.read_csv(path, usecols=columns, dtype=dtypes)[columns].dropna()
+    if position_column is not None:
+        data[position_column] = gpd.points_from_xy(data[lon_column].values, data[lat_column].values)
+    return data
+
+def cache_path(path, class_column, id_column, lat_column='latitude', lon_column='longitude'):
+    """
+    The default sidecar file of an input file and column mapping, next to the input file.
+    """
+    h = hashlib.sha256(repr((class_column, id_column, lat_column, lon_column)).encode()).hexdigest()
+    return path + '.' + h[:12] + '.npz'
+
+def source_key(path, class_column, id_column, lat_column, lon_column):
+    """
+    What a sidecar is valid for: the size and modification time of the input file and the column
+    mapping it was read with.
+    """
+    s = os.stat(path)
+    return json.dumps({'version':CACHE_VERSION, 'path':os.path.abspath(path), 'size':s.st_size, 'mtime':s.st_mtime_ns,
+                       'columns':[class_column, id_column, lat_column, lon_column]})
+
+def save_encoded(fname, D, key):
+    """
+    Write the encoded rows of D to a .npz file, with classes, labels and ids as fixed width
+    strings so the file loads without pickle.
+    """
+    import shapely
+    xy = shapely.get_coordinates(np.asarray(D.positions, dtype=object))
+    with atomic_write(fname) as f:
+        np.savez(f, key=np.array(key), index=D.table.index.values, x=xy[:,0], y=xy[:,1], labels=np.asarray(D.labels, dtype=str),
+                 classes=D.classes, ids=np.asarray(D.ids, dtype=str), instances=D.instances, class_counts=D.class_counts)
+
+def read_encoded(fname, key):
+    """
+    The EncodedData saved in a sidecar, or None if there is none or it was written for a
+    different version of the input file or column mapping.
+    """
+    import geopandas as gpd
+    if not os.path.exists(fname):
+        return None
+    with np.load(fname, allow_pickle=False) as f:
+        if str(f['key']) != key:
+            return None
+        labels = f['labels'].astype(object)
+        classes = f['classes']
+        table = pd.DataFrame({'cat1':labels[classes], 'id1':f['ids'].astype(object), 'pos1':gpd.points_from_xy(f['x'], f['y'])}, index=f['index'])
+        return EncodedData(table, 'pos1', 'cat1', 'id1', codes=(classes, labels, f['instances'], f['class_counts']))
+
+def load_encoded(path, class_column, id_column, lat_column='latitude', lon_column='longitude', cache=None):
+    """
+    Read and encode the feature instances of a .csv or .parquet file for colocate, reusing a
+    binary sidecar of the encoded rows when the file has not changed since it was written.
+    Args:
+        path(string):
+            The input file, read as Parquet if it ends in .parquet or .pq and as CSV otherwise.
+        class_column, id_column, lat_column, lon_column(string):
+            The columns with feature classes, feature ids, latitudes and longitudes.
+        cache(string, bool or None):
+            default None, for a sidecar next to the input file (see cache_path). A string is the
+            path of the sidecar to use instead and False reads the file without a sidecar.
+
+    Returns:
+        An EncodedData with the rows that have a class, id, latitude and longitude.
+    """
+    if cache is False:
+        return EncodedData(read_points(path, class_column, id_column, lat_column, lon_column), 'pos', class_column, id_column)
+    fname = cache_path(path, class_column, id_column, lat_column, lon_column) if cache is None or cache is True else cache
+    key = source_key(path, class_column, id_column, lat_column, lon_column)
+    D = read_encoded(fname, key)
+    if D is None:
+        D = EncodedData(read_points(path, class_column, id_column, lat_column, lon_column), 'pos', class_column, id_column)
+        save_encoded(fname, D, key)
+    return D
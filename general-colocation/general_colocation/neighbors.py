@@ -0,0 +1,136 @@
+import numpy as np
+
+def neighbor_pairs(positions, radius, rows=None, index=None, ordered=True):
+    """
+    Find every pair of positions within radius of each other with an STRtree spatial
+    index instead of comparing all pairs.
+    Args:
+        positions(array-like):
+            Geometries (Point, Polygon, Line) to search.
+        radius(float):
+            The search distance in coordinate units. Pairs at exactly this distance are
+            included, so the caller should still apply its own relation to the result.
+        rows(array-like or None):
+            If specified, only pairs with left in rows are returned.
+        index(shapely.STRtree or None):
+            If specified, an index of positions built earlier, so repeated queries over the
+            same positions (e.g. one for each partition of rows) share it.
+        ordered(bool):
+            default True. If False, every pair with left in rows is returned whatever the order
+            of left and right, so both orders of a pair are returned if both are in rows.
+
+    Returns:
+        left, right: integer arrays of positional indexes into positions with left < right
+    """
+    import shapely
+    positions = np.asarray(positions, dtype=object)
+    index = shapely.STRtree(positions) if index is None else index
+    rows = np.arange(len(positions)) if rows is None else np.asarray(rows)
+    left, right = index.query(positions[rows], predicate='dwithin', distance=radius)
+    left = rows[left]
+    keep = left < right if ordered else left != right
+    return left[keep], right[keep]
+
+def tiled_neighbor_pairs(positions, radius, tiles, rows=None, pairs=None):
+    """
+    Find every pair of positions within radius of each other one spatial tile at a time, so
+    only the positions of one tile and its halo are indexed at once. Each position belongs
+    to the core of exactly one tile, and a pair is only returned by the tile that holds its
+    left position, so no pair is returned twice.
+    Args:
+        positions(array-like):
+            Geometries (Point, Polygon, Line) to search.
+        radius(float):
+            The search distance in coordinate units.
+        tiles(int):
+            The number of tiles along each axis of the bounding box of positions.
+        rows(array-like or None):
+            If specified, only pairs with left in rows are returned.
+        pairs(function or None):
+            If specified, called with the positions of a tile and its halo and the local rows
+            to query in place of neighbor_pairs. Should return (left, right) like neighbor_pairs.
+
+    Returns:
+        A generator of (left, right) integer arrays of positional indexes with left < right,
+        one for each tile
+    """
+    import geopandas as gpd
+    positions = np.asarray(positions, dtype=object)
+    bounds = gpd.GeoSeries(positions).bounds.values
+    minx, miny, maxx, maxy = bounds.T
+    x, y = (minx + maxx) / 2, (miny + maxy) / 2
+    edges_x = np.linspace(np.nanmin(x), np.nanmax(x), tiles+1)[1:-1]
+    edges_y = np.linspace(np.nanmin(y), np.nanmax(y), tiles+1)[1:-1]
+    tile = np.searchsorted(edges_x, x) * tiles + np.searchsorted(edges_y, y)
+    queried = np.zeros(len(bounds), dtype=bool)
+    queried[np.arange(len(bounds)) if rows is None else rows] = True
+
+    # a position is within radius of a core position only if it is within radius plus half the
+    # widest position of the core's cell, so it joins the halo of the tiles of those cells
+    reach_x = radius + np.nanmax(maxx - minx, initial=0) / 2
+    reach_y = radius + np.nanmax(maxy - miny, initial=0) / 2
+    x0, x1 = np.searchsorted(edges_x, minx - reach_x), np.searchsorted(edges_x, maxx + reach_x)
+    y0, y1 = np.searchsorted(edges_y, miny - reach_y), np.searchsorted(edges_y, maxy + reach_y)
+    counts = (x1 - x0 + 1) * (y1 - y0 + 1)
+    owners = np.repeat(np.arange(len(bounds)), counts)
+    offsets = concat_ranges(np.zeros(len(bounds), dtype=np.int64), counts)
+    height = (y1 - y0 + 1)[owners]
+    halo = (x0[owners] + offsets // height) * tiles + y0[owners] + offsets % height
+    order = np.argsort(halo, kind='stable')                                     #by tile, then by row position
+    owners, halo = owners[order], halo[order]
+
+    for t in np.unique(tile):
+        members = owners[np.searchsorted(halo, t):np.searchsorted(halo, t, side='right')]  #core and halo
+        local = np.flatnonzero((tile[members] == t) & queried[members])
+        if len(local) == 0:
+            continue
+        if pairs is None:
+            left, right = neighbor_pairs(positions[members], radius, local)
+        else:
+            left, right = pairs(positions[members], local)
+            left, right = np.asarray(left), np.asarray(right)
+            keep = np.isin(left, local)
+            left, right = left[keep], right[keep]
+        yield members[left], members[right]
+
+def related_pairs(positions, relation, thold, rows=None, tiles=None):
+    """
+    Find the related pairs of a PairRelation, one tile at a time if tiles is specified and the
+    relation gives a radius.
+
+    Returns:
+        A list or generator of (left, right) arrays of positional indexes with left < right
+    """
+    radius = relation.radius(positions, thold) if tiles else None
+    if radius is not None:
+        return tiled_neighbor_pairs(positions, radius, tiles, rows, lambda positions, rows: relation.pairs(positions, thold, rows))
+    return [relation.pairs(positions, thold, rows)]
+
+def all_pairs(n, rows=None, chunk_size=1000000):
+    """
+    Enumerate every pair of positions in chunks of about chunk_size pairs, for relations that
+    cannot use a spatial index.
+    Args:
+        n(int):
+            The number of positions.
+        rows(array-like or None):
+            If specified, only pairs with left in rows are returned.
+        chunk_size(int):
+            The approximate number of pairs to yield at a time.
+
+    Returns:
+        A generator of (left, right) integer arrays of positional indexes with left < right
+    """
+    rows = np.arange(n) if rows is None else np.asarray(rows)
+    step = max(1, chunk_size // max(n, 1))
+    for start in range(0, len(rows), step):
+        left = rows[start:start+step]
+        counts = n - 1 - left
+        yield np.repeat(left, counts), concat_ranges(left + 1, counts)
+
+def concat_ranges(starts, counts):
+    """
+    Concatenate the integer ranges [starts[i], starts[i] + counts[i]) without a Python loop.
+    """
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
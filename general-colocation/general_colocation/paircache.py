@@ -0,0 +1,59 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from general_colocation.neighbors import related_pairs
+from general_colocation.relations import as_pair_relation, get_point_coordinates, PairList
+from general_colocation.checkpoint import describe_relation
+from general_colocation.files import atomic_write
+
+def position_order(positions):
+    """
+    An order of the positions that depends only on their values, and a digest of the positions
+    in that order. Rows with equal positions are related to the same rows, so their order
+    among themselves does not matter.
+    """
+    xy = get_point_coordinates(positions)
+    if xy is not None:
+        xy = np.ascontiguousarray(xy)
+        order = np.argsort(xy.view(np.complex128).ravel())                      #by x and then y in one sort
+        return order, hashlib.sha256(xy[order].tobytes()).digest()
+    values = pd.util.hash_pandas_object(pd.Series(np.asarray(positions, dtype=object)), index=False).values
+    order = np.argsort(values, kind='stable')
+    return order, hashlib.sha256(values[order].tobytes()).digest()
+
+def pair_cache_key(digest, relation, thold):
+    h = hashlib.sha256(digest)
+    h.update(repr((describe_relation(relation), thold)).encode())
+    return h.hexdigest()
+
+def cached_pairs(D, relation, thold, path, tiles=None):
+    """
+    Every related pair of positions of D, read from the pair cache in the directory path or found
+    and added to it. Pairs are stored as an (n, 2) int32 .npy file named by a hash of the
+    positions, the relation and the threshold, with rows numbered in position order rather than
+    in the class order of D, so runs over the same positions with other classes, k, theta or
+    alpha share the file. Pairs of the same class are kept for the same reason. The file is
+    memory-mapped when it is read.
+
+    Returns:
+        A PairList of the pairs as row positions of D, each pair once with left < right
+    """
+    order, digest = position_order(D.positions)
+    fname = os.path.join(path, pair_cache_key(digest, relation, thold)+'.npy')
+    if os.path.exists(fname):
+        P = np.load(fname, mmap_mode='r')
+    else:
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        out = [np.zeros((0,2), dtype=np.int32)]
+        for left, right in related_pairs(D.positions, as_pair_relation(relation), thold, None, tiles):
+            left, right = rank[np.asarray(left)], rank[np.asarray(right)]
+            out.append(np.column_stack([np.minimum(left, right), np.maximum(left, right)]).astype(np.int32))
+        P = np.concatenate(out)
+        P = P[np.lexsort((P[:,1], P[:,0]))]
+        os.makedirs(path, exist_ok=True)
+        with atomic_write(fname) as f:
+            np.save(f, P)
+    left, right = order[P[:,0]], order[P[:,1]]
+    return PairList(np.minimum(left, right), np.maximum(left, right))
@@ -1,26 +1,334 @@
 import numpy as np
-import geopandas as gpd
+import pandas as pd
+from general_colocation.neighbors import neighbor_pairs, all_pairs
+
+EARTH_RADIUS_M = 6371008.8
 
 def meters_to_dist(m):
     return m * 25e-6
 
+def get_point_coordinates(col):
+    """
+    An (n, 2) float array with the x and y of each position, or None unless every
+    position is a point.
+    """
+    import shapely
+    try:
+        col = np.asarray(col, dtype=object)
+        if len(col) == 0 or not np.all(shapely.get_type_id(col) == 0):
+            return None
+    except TypeError:                                                           #positions that are not geometries
+        return None
+    return shapely.get_coordinates(col)
+
+def as_position_series(positions):
+    """
+    The positions as a GeoSeries if they are all geometries (or missing), like the columns of
+    the merged GeoDataFrames that relation functions were first called on, and as a Series otherwise.
+    """
+    import shapely
+    import geopandas as gpd
+    positions = np.asarray(positions, dtype=object)
+    try:
+        geometries = shapely.is_geometry(positions)
+        if np.any(geometries) and np.all(geometries | shapely.is_missing(positions)):
+            return gpd.GeoSeries(positions)
+    except TypeError:                                                           #positions that are not geometries
+        pass
+    return pd.Series(positions)
+
+def get_max_dlon(angle, lat):
+    """
+    The largest longitude difference in radians that two points no further from the equator
+    than the latitudes lat can have while being within angle radians of each other.
+    """
+    c = np.cos(min(np.nanmax(np.abs(lat), initial=0), np.pi/2))
+    if c <= np.sin(angle/2):
+        return np.pi
+    return 2 * np.arcsin(np.sin(angle/2) / c)
+
+def get_deltas(x1, y1, x2, y2):
+    """
+    Latitudes and the latitude and longitude differences in radians of float arrays of
+    longitude (x) and latitude (y) in degrees.
+    """
+    lon1, lat1, lon2, lat2 = np.radians(x1), np.radians(y1), np.radians(x2), np.radians(y2)
+    dlon = np.abs(lon1 - lon2)
+    return lat1, lat2, np.abs(lat1 - lat2), np.minimum(dlon, 2*np.pi - dlon)   #across the antimeridian
+
+def haversine(lat1, lat2, dlat, dlon):
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+def meters_between(x1, y1, x2, y2):
+    """
+    Great-circle distance in meters on float arrays of longitude (x) and latitude (y) in degrees.
+    """
+    return haversine(*get_deltas(x1, y1, x2, y2))
+
+def is_within_meters(x1, y1, x2, y2, thold):
+    """
+    Great-circle distance test on float arrays of longitude (x) and latitude (y) in degrees.
+    Pairs outside the latitude and longitude bounding box of thold meters are dropped before
+    the haversine formula is evaluated on the rest.
+    """
+    lat1, lat2, dlat, dlon = get_deltas(x1, y1, x2, y2)
+    angle = thold / EARTH_RADIUS_M
+    near = np.flatnonzero((dlat <= angle) & (dlon <= get_max_dlon(angle, np.concatenate([lat1, lat2]))))
+
+    out = np.zeros(len(lat1), dtype=bool)
+    out[near] = haversine(lat1[near], lat2[near], dlat[near], dlon[near]) < thold
+    return out
+
 def is_spatial_relation_dist_unit(col1,col2,thold):
+    import geopandas as gpd
     col1 = gpd.GeoSeries(col1)
     col2 = gpd.GeoSeries(col2)
     return col1.distance(col2) < thold
 
 def is_spatial_relation_dist_m(col1,col2, thold):
+    import geopandas as gpd
     thold = meters_to_dist(thold)
     s1 = gpd.GeoSeries(col1, crs="EPSG:3857")
     s2 = gpd.GeoSeries(col2, crs="EPSG:3857")
     return s1.distance(s2) < thold
 
+def is_spatial_relation_meter(col1, col2, thold):
+    """
+    Haversine distance in meters for pairs of points with longitude as x and latitude as y,
+    and the distance of is_spatial_relation_dist_m for pairs of other geometries.
+    """
+    import shapely
+    index = getattr(col1, 'index', None)
+    col1 = np.asarray(col1, dtype=object)
+    col2 = np.asarray(col2, dtype=object)
+    points = (shapely.get_type_id(col1) == 0) & (shapely.get_type_id(col2) == 0)
+    out = np.zeros(len(col1), dtype=bool)
+    out[points] = is_within_meters(shapely.get_x(col1[points]), shapely.get_y(col1[points]), shapely.get_x(col2[points]), shapely.get_y(col2[points]), thold)
+    if not points.all():
+        out[~points] = is_spatial_relation_dist_m(col1[~points], col2[~points], thold)
+    return pd.Series(out, index=index)
+
 def get_relation(relation):
+    if isinstance(relation, PairRelation):
+        return relation
     if(relation == 'meter'):
-            relation = is_spatial_relation_dist_m
+            relation = is_spatial_relation_meter
     elif(relation == 'unit'):
         relation = is_spatial_relation_dist_unit
     else:
         if not callable(relation):
             relation = is_spatial_relation_dist_unit
     return relation
+
+def get_coordinate_relation(relation):
+    """
+    The version of a predefined relation that takes float x and y arrays of points instead
+    of two series of geometries, or None if there is none.
+    """
+    if relation is is_spatial_relation_meter:
+        return is_within_meters
+    return None
+
+def get_search_radius(relation, thold, positions):
+    """
+    The distance in coordinate units a spatial index must search to find every pair the
+    relation may accept, or None if the relation cannot use a spatial index.
+    """
+    if relation is is_spatial_relation_meter:
+        import shapely
+        angle = thold / EARTH_RADIUS_M
+        lat = np.radians(shapely.get_y(np.asarray(positions, dtype=object)))   #NaN for positions that are not points
+        radius = np.degrees(np.hypot(angle, get_max_dlon(angle, lat)))         #corner of the bounding box of is_within_meters
+        if get_point_coordinates(positions) is None:
+            return max(radius, meters_to_dist(thold))
+        return radius
+    if relation is is_spatial_relation_dist_m:
+        return meters_to_dist(thold)
+    elif relation is is_spatial_relation_dist_unit:
+        return thold
+    return None
+
+class PairRelation:
+    """
+    A relation that is given the whole column of positions and returns the related pairs
+    itself, for example by querying a spatial index, instead of testing two aligned series
+    of a cross join. Subclasses implement pairs and may implement radius.
+    """
+    def pairs(self, positions, thold, rows=None):
+        """
+        Args:
+            positions(array-like):
+                The position of every feature instance.
+            thold(int or float):
+                The relation threshold.
+            rows(array-like or None):
+                If specified, only pairs with left in rows are needed. Other pairs may still
+                be returned and are dropped by the caller.
+
+        Returns:
+            left, right: integer arrays of positional indexes into positions of every related
+            pair, each pair once with left < right
+        """
+        raise NotImplementedError
+
+    def neighbors(self, positions, thold, rows):
+        """
+        Every related pair with left in rows, in both orders, e.g. the neighbors of a sample of
+        the rows. By default the pairs of all positions are found and filtered.
+
+        Returns:
+            left, right: integer arrays of positional indexes into positions with left in rows
+        """
+        left, right = self.pairs(positions, thold)
+        left, right = np.r_[left, right], np.r_[right, left]
+        keep = np.isin(left, rows)
+        return left[keep], right[keep]
+
+    def prepare(self, positions, thold):
+        """
+        An optional hook called once in each worker process before pairs of positions are
+        found, e.g. to build a spatial index that every partition of the level then shares.
+        """
+        pass
+
+    def radius(self, positions, thold):
+        """
+        An optional hint: the distance in coordinate units beyond which no two positions are
+        related, or None. With a radius the tiles option can query one tile and its halo at a time.
+        """
+        return None
+
+    def distances(self, positions, left, right):
+        """
+        An optional distance in threshold units for each pair (left[i], right[i]), such that a
+        pair is related under a threshold exactly when its distance is below it, or None. With
+        distances a threshold sweep filters the pairs of the largest threshold instead of
+        testing them again.
+        """
+        return None
+
+    def related(self, positions, left, right, thold):
+        """
+        Test the pairs (left[i], right[i]) by finding the related pairs among the positions
+        that take part in them.
+        """
+        if len(left) == 0:
+            return np.zeros(0, dtype=bool)
+        items, inverse = np.unique(np.concatenate([left, right]), return_inverse=True)
+        inverse = inverse.ravel().astype(np.int64)
+        l, r = self.pairs(positions[items], thold)
+        l, r = np.asarray(l, dtype=np.int64), np.asarray(r, dtype=np.int64)
+        found = np.minimum(l, r) * len(items) + np.maximum(l, r)
+        a, b = inverse[:len(left)], inverse[len(left):]
+        return np.isin(np.minimum(a, b) * len(items) + np.maximum(a, b), found)
+
+class ElementwiseRelation(PairRelation):
+    """
+    Adapter that gives a relation function, which takes two aligned series of positions and
+    a threshold and returns a boolean series, the pair query interface. Candidate pairs come
+    from a spatial index for the predefined relations and from every pair in chunks otherwise.
+    """
+    def __init__(self, relation) -> None:
+        self.relation = relation
+        self.cache = {}                                                         #spatial index, coordinates and radius of the last positions
+
+    def __getstate__(self):
+        return {'relation':self.relation, 'cache':{}}                           #each process builds its own index
+
+    def cached(self, positions, name, make):
+        """
+        The value of make() for positions, computed once as long as the same positions array is
+        passed, so the partitions of a level share one spatial index and one coordinate array.
+        """
+        if self.cache.get('positions') is not positions:
+            self.cache = {'positions':positions}
+        if name not in self.cache:
+            self.cache[name] = make()
+        return self.cache[name]
+
+    def prepare(self, positions, thold):
+        if self.radius(positions, thold) is not None:
+            self.index(positions)
+        self.coordinates(positions)
+
+    def radius(self, positions, thold):
+        return self.cached(positions, ('radius', thold), lambda: get_search_radius(self.relation, thold, positions))
+
+    def index(self, positions):
+        import shapely
+        return self.cached(positions, 'index', lambda: shapely.STRtree(np.asarray(positions, dtype=object)))
+
+    def coordinates(self, positions):
+        """
+        The float x and y of point positions for the predefined relations, or None.
+        """
+        if get_coordinate_relation(self.relation) is None:
+            return None
+        return self.cached(positions, 'coordinates', lambda: get_point_coordinates(positions))
+
+    def pairs(self, positions, thold, rows=None):
+        radius = self.radius(positions, thold)
+        if radius is not None:
+            chunks = [neighbor_pairs(positions, radius, rows, self.index(positions))]
+        else:
+            chunks = all_pairs(len(positions), rows)
+        left, right = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for l, r in chunks:
+            keep = self.related(positions, l, r, thold)
+            left.append(l[keep])
+            right.append(r[keep])
+        return np.concatenate(left), np.concatenate(right)
+
+    def neighbors(self, positions, thold, rows):
+        radius = self.radius(positions, thold)
+        if radius is None:
+            return super().neighbors(positions, thold, rows)
+        left, right = neighbor_pairs(positions, radius, rows, self.index(positions), ordered=False)
+        keep = self.related(positions, left, right, thold)
+        return left[keep], right[keep]
+
+    def related(self, positions, left, right, thold):
+        if len(left) == 0:
+            return np.zeros(0, dtype=bool)
+        xy = self.coordinates(positions)
+        if xy is not None:                                                      #predefined relations on points run on float coordinates
+            return get_coordinate_relation(self.relation)(xy[left,0], xy[left,1], xy[right,0], xy[right,1], thold)
+        return np.asarray(self.relation(as_position_series(positions[left]), as_position_series(positions[right]), thold), dtype=bool)
+
+    def distances(self, positions, left, right):
+        import shapely
+        col1 = np.asarray(positions[left], dtype=object)
+        col2 = np.asarray(positions[right], dtype=object)
+        if self.relation is is_spatial_relation_dist_unit:
+            return shapely.distance(col1, col2)
+        if self.relation is is_spatial_relation_dist_m:
+            return shapely.distance(col1, col2) / meters_to_dist(1)
+        if self.relation is is_spatial_relation_meter:
+            points = (shapely.get_type_id(col1) == 0) & (shapely.get_type_id(col2) == 0)
+            out = shapely.distance(col1, col2) / meters_to_dist(1)
+            out[points] = meters_between(shapely.get_x(col1[points]), shapely.get_y(col1[points]), shapely.get_x(col2[points]), shapely.get_y(col2[points]))
+            return out
+        return None
+
+class PairList(PairRelation):
+    """
+    A fixed list of related pairs of positional indexes, for example the pairs of one
+    threshold in a sweep. Relation tests are lookups in the list.
+    """
+    def __init__(self, left, right) -> None:
+        self.left = np.asarray(left)
+        self.right = np.asarray(right)
+
+    def pairs(self, positions, thold, rows=None):
+        return self.left, self.right
+
+    def related(self, positions, left, right, thold):
+        n = len(positions)
+        found = np.minimum(self.left, self.right).astype(np.int64) * n + np.maximum(self.left, self.right)
+        return np.isin(np.minimum(left, right).astype(np.int64) * n + np.maximum(left, right), found)
+
+def as_pair_relation(relation):
+    if isinstance(relation, PairRelation):
+        return relation
+    return ElementwiseRelation(relation)
@@ -0,0 +1,100 @@
+import numpy as np
+from statistics import NormalDist
+from general_colocation.relations import PairList
+
+class InstanceSample:
+    """
+    A random sample of up to size feature instances of each class. Participation ratios are
+    estimated from the share of sampled instances that take part in a colocation, with a
+    Wilson score interval at the given confidence level that is corrected for sampling
+    without replacement, so classes with at most size instances are counted exactly.
+
+    Only the instances of colocations that hold a sampled feature instance are generated, by
+    extending them through the neighbors of their sampled items (see Neighborhoods).
+    """
+    def __init__(self, D, size, confidence=0.95, verify=False, seed=0) -> None:
+        self.size = size
+        self.confidence = confidence
+        self.verify = verify
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+        _, first = np.unique(D.instances, return_index=True)                     #one row for each distinct (class, id)
+        classes = D.classes[first]
+        order = np.lexsort((np.random.default_rng(seed).random(len(first)), classes))   #random order within each class
+        rank = np.arange(len(order)) - np.searchsorted(classes[order], classes[order])
+        self.mask = np.zeros(len(first), dtype=bool)                             #True for sampled instances
+        self.mask[order[(rank < size) & (classes[order] >= 0)]] = True
+        self.counts = np.bincount(classes[self.mask], minlength=len(D.labels))
+
+    def estimate(self, D, counts, classes):
+        """
+        Estimate the participation index of each colocation and its confidence interval from the
+        number of sampled instances of each of its classes that take part in it.
+        Args:
+            D(EncodedData):
+                The encoded feature instances.
+            counts(numpy.ndarray):
+                Sampled instances taking part, one row for each colocation and one column for each class.
+            classes(numpy.ndarray):
+                The class codes of each colocation, with the same shape as counts.
+
+        Returns:
+            prevalence, lower, upper: arrays with one value for each colocation
+        """
+        n = self.counts[classes]
+        N = D.class_counts[classes]
+        p = counts / n
+        z = self.z * np.sqrt((N - n) / np.maximum(N - 1, 1))                      #finite population correction
+        center = (p + z**2 / (2*n)) / (1 + z**2 / n)
+        half = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+        lower = np.clip(center - half, 0, 1)
+        upper = np.clip(center + half, 0, 1)
+        return p.min(axis=1), lower.min(axis=1), upper.min(axis=1)
+
+class Neighborhoods:
+    """
+    The neighbors of each row searched so far, like the star neighborhoods of the joinless
+    engine but with every neighbor of a row whatever its class: the neighbors of row i are
+    neighbors[indptr[i]:indptr[i+1]]. Sampled rows are searched first, and the rows of the
+    classes that borderline colocations are verified at are added later, each row only once.
+    """
+    def __init__(self, n, pairs=None) -> None:
+        self.searched = np.zeros(n, dtype=bool)
+        self.indptr = np.zeros(n+1, dtype=np.int64)
+        self.neighbors = np.zeros(0, dtype=np.int32)
+        self.cache = pairs                                                      #pairs of a pair cache, filtered instead of searched
+
+    def search(self, D, relation, thold, rows):
+        """
+        Add the neighbors of the rows that were not searched yet.
+        """
+        rows = rows[~self.searched[rows]]
+        if len(rows) == 0:
+            return
+        if self.cache is None:
+            left, right = relation.neighbors(D.positions, thold, rows)
+        else:
+            found = np.zeros(len(D), dtype=bool)
+            found[rows] = True
+            left, right = np.r_[self.cache.left, self.cache.right], np.r_[self.cache.right, self.cache.left]
+            keep = found[left]
+            left, right = left[keep], right[keep]
+        left = np.r_[np.repeat(np.arange(len(D)), np.diff(self.indptr)), left]
+        right = np.r_[self.neighbors, right]
+        order = np.lexsort((right, left))
+        self.indptr = np.searchsorted(left[order], np.arange(len(D)+1))
+        self.neighbors = np.asarray(right[order], dtype=np.int32)
+        self.searched[rows] = True
+
+    def pairs(self, rows):
+        """
+        A PairList of the related pairs that hold one of rows, which must have been searched,
+        each pair once.
+        """
+        n = len(self.searched)
+        left = np.repeat(np.arange(n), np.diff(self.indptr))
+        keep = np.zeros(n, dtype=bool)
+        keep[rows] = True
+        keep = keep[left]
+        keys = np.unique(np.minimum(left[keep], self.neighbors[keep]).astype(np.int64) * n + np.maximum(left[keep], self.neighbors[keep]))
+        return PairList(keys // n, keys % n)
@@ -0,0 +1,143 @@
+import os
+import copy
+import numpy as np
+from collections.abc import Sequence
+from general_colocation.encoding import get_patterns, decode_table_instance
+
+PARTITION_ROWS = 1000000                                                        #rows of a spilled partition, unless one class of the first item has more
+
+def write_instances(path, I, P, D):
+    """
+    Write a partition of a table instance to a .npy file sorted by colocation and point the
+    table instance of each prevalent colocation in P at its slice of the memory-mapped file.
+    Returns the path of the file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _, inverse = get_patterns(D, I)
+    np.save(path, I[np.argsort(inverse, kind='stable')])
+    map_instances(path, P, D)
+    return path
+
+def map_instances(path, P, D):
+    """
+    Point the table instance of each prevalent colocation in P that is in a file written by
+    write_instances at its slice of the memory-mapped file.
+    """
+    I = np.load(path, mmap_mode='r')
+    patterns, inverse = get_patterns(D, I)
+    ends = np.cumsum(np.bincount(inverse, minlength=len(patterns)))
+    for i, p in enumerate(patterns):
+        if p in P:
+            P[p].table_instance = I[ends[i]-P[p].size:ends[i]]
+
+def unmap_instances(P):
+    """
+    Copies of the colocations of P without their table instances, so that pickling them does not
+    copy the memory-mapped slices of the spilled files into the pickle. map_instances points
+    them at the files again.
+    """
+    out = {}
+    for p, c in P.items():
+        out[p] = copy.copy(c)
+        out[p].table_instance = None
+    return out
+
+def bounded_partitions(D, I, rows):
+    """
+    Split a table instance sorted by row position into consecutive partitions of whole classes
+    of the first item, each with at most rows rows unless a single class has more.
+    """
+    first = D.classes[I[:,0]]
+    cuts = np.flatnonzero(first[1:] != first[:-1]) + 1
+    ends = np.r_[cuts[1:], len(I)]
+    keep, start = [], 0
+    for cut, end in zip(cuts.tolist(), ends.tolist()):
+        if end - start > rows:                                                  #the next class would take the partition past rows
+            keep.append(cut)
+            start = cut
+    return np.split(I, keep)
+
+class PartitionWriter:
+    """
+    Spills the partitions of a table instance as they are mined, in the order of the class of
+    their first item. Small partitions are merged and large ones split at class boundaries so
+    that each file has about rows rows, whatever the number of classes.
+    """
+    def __init__(self, path, D, rows=PARTITION_ROWS) -> None:
+        self.path = path
+        self.data = D
+        self.rows = rows
+        self.files = []
+        self.buffer = []
+        self.size = 0
+        self.patterns = {}
+    def add(self, I, P):
+        self.patterns.update(P)
+        for part in bounded_partitions(self.data, I, self.rows):
+            if self.size > 0 and self.size + len(part) > self.rows:
+                self.flush()
+            self.buffer.append(part)
+            self.size += len(part)
+    def flush(self):
+        if self.size > 0:
+            fname = os.path.join(self.path, str(len(self.files))+'.npy')
+            self.files.append(write_instances(fname, np.concatenate(self.buffer), self.patterns, self.data))
+        self.buffer, self.size = [], 0
+    def close(self):
+        """
+        Write what is left and return the paths of the files in order.
+        """
+        self.flush()
+        return self.files
+
+def spill_star_neighborhoods(path, D, parts, rows):
+    """
+    The star neighborhoods of a spilled table instance of size 2, like generate_star_neighborhoods,
+    written to .npy files one partition at a time and memory-mapped, so no more than one
+    partition of pairs is in memory. Partitions hold increasing ranges of rows, so writing them
+    in order keeps the pairs sorted.
+    """
+    os.makedirs(path, exist_ok=True)
+    neighbors = np.lib.format.open_memmap(os.path.join(path, 'neighbors.npy'), mode='w+', dtype=np.int32, shape=(rows,))
+    pair_keys = np.lib.format.open_memmap(os.path.join(path, 'pair_keys.npy'), mode='w+', dtype=np.int64, shape=(rows,))
+    counts = np.zeros(len(D), dtype=np.int64)
+    start = 0
+    for part in parts:
+        I = read_instances(part)
+        neighbors[start:start+len(I)] = I[:,1]
+        pair_keys[start:start+len(I)] = I[:,0].astype(np.int64) * len(D) + I[:,1]
+        counts += np.bincount(I[:,0], minlength=len(D))
+        start += len(I)
+    neighbors.flush()
+    pair_keys.flush()
+    np.save(os.path.join(path, 'indptr.npy'), np.r_[0, np.cumsum(counts)])
+    return tuple(np.load(os.path.join(path, name+'.npy'), mmap_mode='r') for name in ['indptr', 'neighbors', 'pair_keys'])
+
+def read_instances(I):
+    """
+    Load a partition written by write_instances back into memory in row position order.
+    Arrays that were never spilled are returned as they are.
+    """
+    if not isinstance(I, str):
+        return I
+    I = np.load(I, mmap_mode='r')
+    return np.asarray(I[np.lexsort(I.T[::-1])])
+
+def read_table_instance(parts, k):
+    """
+    Load all partitions of a spilled table instance of size k into one array.
+    """
+    return np.concatenate([np.zeros((0,k), dtype=np.int32)] + [read_instances(part) for part in parts])
+
+class SpilledTables(Sequence):
+    """
+    The table instances of a spilled run, one for each k value. Each table instance is read
+    from disk and decoded only when it is indexed.
+    """
+    def __init__(self, D, T) -> None:
+        self.data = D
+        self.levels = T
+    def __len__(self) -> int:
+        return len(self.levels)
+    def __getitem__(self, k):
+        return decode_table_instance(self.data, read_table_instance(self.levels[k], range(len(self))[k] + 1))
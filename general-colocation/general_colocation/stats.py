@@ -0,0 +1,107 @@
+import time
+import tracemalloc
+import pandas as pd
+from contextlib import contextmanager
+
+class PhaseStats:
+    def __init__(self, k, phase, wall=0.0, cpu=0.0, peak_memory=None, rows=0) -> None:
+        self.k = k
+        self.phase = phase
+        self.wall = wall
+        self.cpu = cpu
+        self.peak_memory = peak_memory
+        self.rows = rows
+    def __str__(self) -> str:
+        memory = '' if self.peak_memory is None else ', '+str(round(self.peak_memory / 2**20, 2))+' MiB peak'
+        return 'k='+str(self.k)+' '+self.phase+': '+str(round(self.wall, 4))+'s wall, '+str(round(self.cpu, 4))+'s cpu'+memory+', '+str(self.rows)+' rows'
+
+class MiningStats:
+    """
+    Wall time, CPU time, peak memory and row counts of each phase of each k value of a run.
+    Phases are 'candidates' (candidate generation), 'join' (joining table instances, or
+    extending them by star neighborhoods with the joinless engine), 'relation' (finding or
+    testing related pairs), 'prevalence' and 'rules', plus a 'level' record for the whole
+    k value. The rows of a phase are the number of candidates, of joined instances, of related
+    instances, of instances whose prevalence is computed and of instances of prevalent
+    colocations that rules are made from. Phases run by worker processes or over spilled partitions are summed, so their
+    wall times can add up to more than the wall time of the level.
+
+    Peak memory is the largest amount of memory allocated by a phase above what was allocated
+    when it started, as traced by tracemalloc (numpy arrays included). Tracing slows down
+    allocations (by about 15% on the full Minneapolis data), so it is only done with memory=True.
+    Args:
+        callback(function or None):
+            If specified, called with the PhaseStats of each phase and then of the level once
+            each k value is mined.
+        verbose(bool):
+            default False. If True, the sizes and elapsed time of each k value are printed.
+        memory(bool):
+            default False. If True, peak memory is traced, otherwise it is None.
+    """
+    def __init__(self, callback=None, verbose=False, memory=False) -> None:
+        self.callback = callback
+        self.verbose = verbose
+        self.memory = memory
+        self.records = []
+
+    @contextmanager
+    def phase(self, k, name):
+        """
+        Measure the body of a with statement as phase name of k. Yields the PhaseStats, whose
+        rows the body can set.
+        """
+        record = PhaseStats(k, name)
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if self.memory:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall
+            record.cpu = time.process_time() - cpu
+            if self.memory:
+                record.peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+            if tracing:
+                tracemalloc.stop()
+            self.records.append(record)
+
+    def merge(self, records):
+        """
+        Add records measured elsewhere (e.g. by a worker process), summing the times and rows
+        of records with the same k and phase and keeping the largest peak memory.
+        """
+        for r in records:
+            found = [s for s in self.records if s.k == r.k and s.phase == r.phase]
+            if len(found) == 0:
+                self.records.append(PhaseStats(r.k, r.phase, r.wall, r.cpu, r.peak_memory, r.rows))
+                continue
+            s = found[0]
+            s.wall += r.wall
+            s.cpu += r.cpu
+            s.rows += r.rows
+            if r.peak_memory is not None:
+                s.peak_memory = r.peak_memory if s.peak_memory is None else max(s.peak_memory, r.peak_memory)
+
+    def level(self, k, wall, cpu, rows):
+        """
+        Add the record of the whole k value, with the largest peak memory of its phases, and pass
+        the records of k to the callback.
+        """
+        peaks = [r.peak_memory for r in self.records if r.k == k and r.peak_memory is not None]
+        self.records.append(PhaseStats(k, 'level', wall, cpu, max(peaks) if len(peaks) > 0 else None, rows))
+        if self.callback is not None:
+            for r in self.records:
+                if r.k == k:
+                    self.callback(r)
+
+    def table(self):
+        """
+        One row for each record, e.g. stats.table().groupby('phase')['wall'].sum() for the
+        hot phase of a run.
+        """
+        columns = ['k','phase','wall','cpu','peak_memory','rows']
+        return pd.DataFrame([(r.k, r.phase, r.wall, r.cpu, r.peak_memory, r.rows) for r in self.records], columns=columns)
@@ -0,0 +1,182 @@
+import math
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from itertools import combinations
+from general_colocation.classes import Rule
+from general_colocation.relations import EARTH_RADIUS_M
+
+class SyntheticData:
+    """
+    Feature instances with planted colocation patterns, in the class/id/position shape that
+    general expects, and the T, P and R that mining them should return.
+
+    The plane is a grid of cells 2*threshold apart. Each planted instance of a pattern takes one
+    cell and puts one point of each of its classes within 0.45*threshold of the cell center, so
+    all its points are related to each other. Every other point is alone in its cell, so no two
+    points in different cells are related and the participation index of every colocation is
+    known exactly. Cells are spread over a grid with a share density of its cells taken.
+    Args:
+        classes(int):
+            The number of feature classes, labeled 'c0', 'c1', ...
+        patterns(int or list of tuples):
+            Either the number of patterns of size k to draw at random from the classes, or the
+            patterns themselves as tuples of class indexes.
+        k(int):
+            The size of random patterns.
+        instances(int or list of int):
+            The number of planted instances of each pattern.
+        participation(float or list of float):
+            The participation index to aim for with each pattern. Enough unrelated points are
+            added to the classes of each pattern to bring its participation ratios down to it.
+            The participation index of a pattern can end up higher when its classes also take
+            part in other patterns; expected gives the exact values.
+        background(int):
+            The number of unrelated points of every class, including classes in no pattern.
+        threshold(float):
+            The relation threshold to mine the data with.
+        density(float):
+            The share of grid cells that hold points, in (0, 1].
+        origin(tuple or None):
+            If None, x and y are plain units for the 'unit' relation. If a (longitude, latitude)
+            pair, the grid is laid out in meters east and north of it for the 'meter' relation.
+        seed(int):
+            The seed of the random patterns and positions.
+    """
+    def __init__(self, classes=20, patterns=5, k=3, instances=1000, participation=0.5, background=0, threshold=1.0, density=0.5,
+                 origin=None, seed=0) -> None:
+        rng = np.random.default_rng(seed)
+        if isinstance(patterns, int):
+            patterns = [tuple(sorted(rng.choice(classes, size=k, replace=False).tolist())) for _ in range(patterns)]
+        self.patterns = [tuple(sorted(p)) for p in patterns]
+        self.instances = [instances] * len(self.patterns) if isinstance(instances, int) else list(instances)
+        participation = [participation] * len(self.patterns) if isinstance(participation, (int, float)) else list(participation)
+        self.labels = np.array(['c'+str(c).zfill(len(str(classes-1))) for c in range(classes)], dtype=object)
+        self.threshold = threshold
+        self.density = density
+        self.origin = origin
+        self.seed = seed
+
+        self.planted = np.zeros(classes, dtype=np.int64)                         #points of each class in planted instances
+        needed = np.zeros(classes, dtype=np.int64)                               #points of each class for the aimed participation
+        for p, m, pi in zip(self.patterns, self.instances, participation):
+            self.planted[list(p)] += m
+            needed[list(p)] = np.maximum(needed[list(p)], math.ceil(m / pi))
+        self.alone = np.maximum(needed - self.planted, 0) + background           #unrelated points of each class
+        self.class_counts = self.planted + self.alone
+
+        self.cells = sum(self.instances) + int(self.alone.sum())
+        self.grid = max(1, math.ceil(self.cells / density))
+        self.width = math.ceil(math.sqrt(self.grid))
+        self.step = int(rng.integers(1, self.grid)) if self.grid > 1 else 1     #cell i goes to (step*i + shift) % grid, a permutation
+        while math.gcd(self.step, self.grid) != 1:
+            self.step += 1
+        self.shift = int(rng.integers(0, self.grid))
+
+    def __len__(self) -> int:
+        return int(self.class_counts.sum())
+
+    def segments(self):
+        """
+        The items of each part of the data in cell order: (first cell, classes, first ids, count),
+        one for the planted instances of each pattern and one for the unrelated points of each class.
+        """
+        cell, ids = 0, np.zeros(len(self.labels), dtype=np.int64)
+        for p, m in zip(self.patterns, self.instances):
+            yield cell, p, ids[list(p)].copy(), m
+            cell += m
+            ids[list(p)] += m
+        for c in np.flatnonzero(self.alone):
+            yield cell, (int(c),), ids[[c]].copy(), int(self.alone[c])
+            cell += int(self.alone[c])
+
+    def chunks(self, chunk_size=1000000):
+        """
+        Generate the data as GeoDataFrames with 'class', 'id' and 'pos' columns holding the points
+        of up to chunk_size cells each, so the whole dataset is never in memory at once. The same
+        seed and chunk_size give the same points.
+        """
+        for first, p, ids, m in self.segments():
+            for start in range(0, m, chunk_size):
+                cells = np.arange(first+start, first+min(m, start+chunk_size))
+                yield self.points(cells, p, ids + start)
+
+    def frame(self):
+        """
+        All the data as one GeoDataFrame.
+        """
+        return pd.concat(list(self.chunks()), ignore_index=True)
+
+    def points(self, cells, p, ids):
+        n = len(cells)
+        rng = np.random.default_rng([self.seed, int(cells[0])])                 #positions depend on the first cell of the chunk
+        grid_cell = (self.step * cells + self.shift) % self.grid
+        spacing = 2 * self.threshold
+        center_x = np.repeat((grid_cell % self.width + 0.5) * spacing, len(p))
+        center_y = np.repeat((grid_cell // self.width + 0.5) * spacing, len(p))
+        r = 0.45 * self.threshold * np.sqrt(rng.random(n * len(p)))
+        angle = 2 * np.pi * rng.random(n * len(p))
+        x, y = center_x + r * np.cos(angle), center_y + r * np.sin(angle)
+        if self.origin is not None:                                              #meters east and north of origin to longitude and latitude
+            scale = EARTH_RADIUS_M * np.cos(np.radians(self.origin[1] + np.degrees(center_y / EARTH_RADIUS_M)))  #the same in a whole cell
+            x, y = self.origin[0] + np.degrees(x / scale), self.origin[1] + np.degrees(y / EARTH_RADIUS_M)
+        out = pd.DataFrame({'class':np.tile(self.labels[list(p)], n), 'id':(ids[None,:] + np.arange(n)[:,None]).ravel()})
+        return gpd.GeoDataFrame(out, geometry=gpd.points_from_xy(x, y)).rename_geometry('pos')
+
+    def count(self, items):
+        """
+        The number of instances of a colocation of class indexes, or of points of a single class.
+        """
+        if len(items) == 1:
+            return int(self.class_counts[items[0]])
+        return sum(m for p, m in zip(self.patterns, self.instances) if set(items) <= set(p))
+
+    def expected(self, k, theta, alpha):
+        """
+        The result of mining the data up to size k.
+
+        Returns:
+            rows: The number of rows in the table instance of each k value, like result.rows
+            P: A list with a dictionary of the participation index of each prevalent colocation
+                (as a tuple of class labels) for each k value
+            R: A set of Rule objects
+        """
+        present = [c for c in range(len(self.labels)) if self.class_counts[c] > 0]
+        rows = [len(self)]
+        P = [{(c,):1.0 for c in present}]
+        R = set()
+        for size in range(2, k+1):
+            subsets = set(s for p in self.patterns for s in combinations(p, size))
+            candidates = [s for s in subsets if all(s[:i] + s[i+1:] in P[-1] for i in range(size))]
+            rows.append(sum(self.count(s) for s in candidates))
+            P.append({})
+            for s in candidates:
+                prevalence = min(self.count(s) / self.class_counts[c] for c in s)
+                if prevalence >= theta:
+                    P[-1][s] = prevalence
+            for s, prevalence in P[-1].items():
+                for i in range(size):
+                    antecedent = s[:i] + s[i+1:]
+                    cp = self.count(s) / self.count(antecedent)
+                    if cp > alpha:
+                        R.add(Rule(tuple(self.labels[list(antecedent)]), self.labels[s[i]], prevalence, cp))
+            if len(P[-1]) == 0:
+                break
+        return rows, [{tuple(self.labels[list(s)]):v for s,v in level.items()} for level in P], R
+
+    def table_instance(self, items):
+        """
+        The expected instances of a colocation of class indexes as a DataFrame with cat and id
+        columns like T, without the position column.
+        """
+        out = []
+        for first, p, ids, m in list(self.segments())[:len(self.patterns)]:
+            if set(items) <= set(p):
+                columns = [p.index(c) for c in items]
+                out.append(ids[columns][None,:] + np.arange(m)[:,None])
+        ids = np.concatenate([np.zeros((0, len(items)), dtype=np.int64)] + out)
+        T = {}
+        for i, c in enumerate(items, 1):
+            T['cat'+str(i)] = self.labels[c]
+            T['id'+str(i)] = ids[:,i-1]
+        return pd.DataFrame(T, index=range(len(ids)))
@@ -1,10 +1,8 @@
-import geopandas as gpd
 import pandas as pd
-from itertools import combinations
-from shapely.geometry import Point
-import matplotlib.pyplot as plt
-import imageio
 import os
+from general_colocation.loading import read_points
+
+# plotting libraries are imported by the functions that plot, so mining never loads them
 
 def adjust_bounds(bounds):
     xmin, ymin, xmax, ymax = bounds
@@ -31,24 +29,22 @@ def adjust_bounds(bounds):
         xmax = xmid + mid_width
     return xmin, ymin, xmax, ymax
 
-def generate_supersets(S,k):
-    for colocation1 in S:
-        item1 = colocation1.items
-        for colocation2 in S:
-            item2 = colocation2.items
-            union = list(set(item1) | set(item2))
-            if len(union) == k+1:
-                union.sort()
-                yield tuple(union)
-
-def generate_subsets(S, k):
-    return set(combinations(S, k))
+def generate_prefix_joins(S):
+    by_prefix = {}
+    for items in sorted(S):                                 # group sorted itemsets by all but their last item
+        by_prefix.setdefault(items[:-1], []).append(items[-1])
+    for prefix, last in by_prefix.items():
+        for i in range(len(last)):
+            for j in range(i+1, len(last)):
+                yield prefix + (last[i], last[j])
 
 def read_poi_file(fname, target_column):
-    data = pd.read_csv('data/' + fname)
-    return data[['safegraph_place_id',target_column,'latitude','longitude']].dropna()
+    # only the needed columns are parsed, and the 'pos' column is built from latitude and longitude
+    return read_points('data/' + fname, target_column, 'safegraph_place_id')
 
 def plot_table_instance(E, T, class_column, id_column, k, shape_file=None, out=None):
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
     T = T[k - 1]
 
     if len(T) == 0:
@@ -83,6 +79,9 @@ def plot_table_instance(E, T, class_column, id_column, k, shape_file=None, out=N
     return plt
 
 def plot_emergent(E, T, class_column, id_column, title, shape_file, out=None):
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
+    from shapely.geometry import Point
     ids = pd.unique(T[['new_id','old_id']].values.ravel('K'))
     to_plot = E[E[id_column].isin(ids)]
 
@@ -119,6 +118,7 @@ def plot_emergent(E, T, class_column, id_column, title, shape_file, out=None):
     return plt
 
 def emergent_to_gif(png_dir):
+    import imageio
     frames_per_plot = 10
     files = []
     for (_,_, filenames) in os.walk(png_dir):
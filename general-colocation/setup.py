@@ -25,7 +25,7 @@ setup(
     ],
     packages=find_packages(),
     include_package_data=True,
-    install_requires=["pandas", "geopandas", "shapely", "numpy", "matplotlib", "imageio"],
+    install_requires=["pandas", "geopandas>=0.14", "shapely>=2.0", "numpy", "matplotlib", "imageio"],
     entry_points={
         "console_scripts": [
             "colocation=general_colocation:colocation.main",